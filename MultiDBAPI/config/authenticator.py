@@ -8,6 +8,7 @@ from jwt.exceptions import InvalidSignatureError
 
 from config.settings import AUTHORIZATION_STATUS, JWT_SETTINGS, SECRET_KEY
 from models.models import User
+from services.executor import DatabaseExecutor
 
 
 class TokenParser:
@@ -78,7 +79,7 @@ class CentralAuthHandler(AuthenticationHandler):
             access_token = header_value.decode("utf-8").split('Bearer ')[-1].strip()
             try:
                 access_token_obj = AccessToken(access_token)
-                user = access_token_obj.get_user
+                user = await DatabaseExecutor().run(lambda: access_token_obj.get_user)
                 context.identity = Identity({"user": user}, "True")
             except Exception as ex:
                 print("exception happend in token authentication!")
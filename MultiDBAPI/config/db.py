@@ -1,45 +1,64 @@
 import logging
+from contextvars import ContextVar
 
 import sqlalchemy.exc
 from urllib.parse import quote
-from config.settings import DB_ENGINE, DB_HOST, DB_PORT, DB_APPLICATION_NAME
+from config.engine_registry import EngineRegistry
+from config.request_context import RequestContext
+from config.settings import (
+    DB_APPLICATION_NAME,
+    DB_ASYNC_MODE,
+    DB_CONNECT_TIMEOUT,
+    DB_ENGINE,
+    DB_HOST,
+    DB_PORT,
+)
 from exceptions.custom_exceptions import DatabaseInfoError
 from psycopg2 import OperationalError
-import sqlalchemy as sql
 from sqlalchemy import inspect, text
 
 
+_current_config = ContextVar("db_config", default=None)
+
+
 class DbConfig:
-    _instance = None
+    """
+    Database configuration of the current request.
+
+    The database and credentials are read from the immutable `RequestContext` of the
+    request, never written by the request handlers. The configuration is kept in a
+    context variable next to it, so concurrent requests (and the executor threads running
+    their queries) never see each other's credentials.
+    """
 
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+        context = RequestContext.current()
+        if context is None:
+            raise DatabaseInfoError("Missing required database information")
+        instance = _current_config.get()
+        if instance is None or instance.context is not context:
+            instance = super().__new__(cls)
+            instance.context = context
+            instance.generate_database()
+            _current_config.set(instance)
+        return instance
 
     def generate_database(self):
-        # self._user = DB_USER
-        # self._password = DB_PASS
         self._application_name = (
             quote(DB_APPLICATION_NAME) if DB_APPLICATION_NAME else None
         )
         self._engine = DB_ENGINE
         self._host = DB_HOST
         self._port = DB_PORT
+        self._name = self.context.database_name
+        self._user = self.context.username
+        self._password = quote(self.context.password)
         return self
 
-    def set_database_name(self, database_name: str):
-        self._name = database_name
-
-    def set_database_user_pass(self, database_name: str, user_name: str, password: str):
-        self._name = database_name
-        self._user = user_name
-        self._password = quote(password)
-
     @property
     def database_connection_url(self):
         # logging.info("application name: %s", self._application_name)
-        if self._application_name:
+        if self._application_name and not DB_ASYNC_MODE:
             # logging.info(
             #     f"{self._engine}://{self._user}:{self._password}@{self._host}:{self._port}/{self._name}?application_name={self._application_name}"
             # )
@@ -54,10 +73,38 @@ class DbConfig:
     def database_name(self):
         return self._name
 
+    @property
+    def engine_key(self):
+        return EngineRegistry.make_key(
+            self._host, self._port, self._name, self._user, self._password
+        )
+
+    @property
+    def connect_args(self):
+        if not DB_ASYNC_MODE:
+            return {"connect_timeout": DB_CONNECT_TIMEOUT}
+        # asyncpg does not accept application_name as a connection url parameter
+        connect_args = {"timeout": DB_CONNECT_TIMEOUT}
+        if self._application_name:
+            connect_args["server_settings"] = {"application_name": DB_APPLICATION_NAME}
+        return connect_args
+
+    def get_engine(self):
+        """Return the pooled engine of the current database and user"""
+        return EngineRegistry().get_engine(
+            self.engine_key, self.database_connection_url, self.connect_args
+        )
+
+    def get_async_engine(self):
+        """Return the pooled AsyncEngine of the current database and user (async driver only)"""
+        return EngineRegistry().get_async_engine(
+            self.engine_key, self.database_connection_url, self.connect_args
+        )
+
     def get_db_columns(self, model_name: str):
         """Get and Return Table Information from Database after processing"""
+        engine = self.get_engine()
         try:
-            engine = sql.create_engine(self.database_connection_url)
             with engine.connect() as connection:
                 inspector = inspect(connection)
                 if not inspector.has_table(model_name):
@@ -66,7 +113,6 @@ class DbConfig:
                     )
                 columns = inspector.get_columns(model_name)
 
-            engine.dispose()
             return columns
         except DatabaseInfoError as ex:
             raise Exception(
@@ -86,6 +132,80 @@ class DbConfig:
                 f"Database not found for the provided database name: {self.database_name}"
             )
 
+    def get_db_tables_info(self, table_names: list = None) -> dict:
+        """
+        Reflect the tables of the database in bulk (all tables if `table_names` is None).
+
+        Returns {table_name: {"columns", "primary_key", "indexes", "foreign_keys"}}
+        """
+        engine = self.get_engine()
+        try:
+            with engine.connect() as connection:
+                inspector = inspect(connection)
+                options = {"filter_names": table_names} if table_names else {}
+                columns = inspector.get_multi_columns(**options)
+                primary_keys = inspector.get_multi_pk_constraint(**options)
+                indexes = inspector.get_multi_indexes(**options)
+                foreign_keys = inspector.get_multi_foreign_keys(**options)
+
+            tables_info = {}
+            for key, table_columns in columns.items():
+                schema_name, table_name = key
+                tables_info[table_name] = {
+                    "columns": table_columns,
+                    "primary_key": primary_keys.get(key),
+                    "indexes": indexes.get(key, []),
+                    "foreign_keys": foreign_keys.get(key, []),
+                }
+            return tables_info
+        except OperationalError as ex:
+            raise Exception(
+                f"Database not found for the provided database name: {self.database_name}"
+            )
+        except sqlalchemy.exc.OperationalError as ex:
+            raise Exception(
+                f"password authentication failed for user: {self._user}",
+                {"status_code": 403},
+            )
+        except Exception as ex:
+            raise Exception(
+                f"Database not found for the provided database name: {self.database_name}"
+            )
+
+    def get_table_version(self, model_name: str):
+        """
+        Return a cheap catalog marker of the table definition.
+
+        The marker changes whenever a DDL statement touches the table's `pg_class` row or
+        any of its `pg_attribute` rows. Returns None for other dialects or on failure.
+        """
+        return self.get_table_versions([model_name]).get(model_name)
+
+    def get_table_versions(self, table_names: list) -> dict:
+        """Return the catalog markers of the tables as {table_name: marker}"""
+        query = text(
+            """SELECT c.relname, c.xmin::text || ':' || c.relnatts::text || ':' || (
+                   SELECT md5(string_agg(
+                       a.attname || ':' || a.atttypid::text || ':' || a.atttypmod::text || ':'
+                       || a.attnotnull::text || ':' || a.attisdropped::text || ':' || a.xmin::text,
+                       ',' ORDER BY a.attnum))
+                   FROM pg_attribute a WHERE a.attrelid = c.oid AND a.attnum > 0)
+               FROM pg_class c WHERE c.oid IN (
+                   SELECT to_regclass(quote_ident(name))
+                   FROM unnest(CAST(:table_names AS text[])) AS name
+               )"""
+        )
+        engine = self.get_engine()
+        if engine.dialect.name != "postgresql":
+            return {}
+        try:
+            with engine.connect() as connection:
+                result = connection.execute(query, {"table_names": list(table_names)})
+                return {row[0]: row[1] for row in result}
+        except Exception as ex:
+            logging.error(f"Exception from {self.get_table_versions.__name__}: {ex}")
+            return {}
+
     def get_model_permissions(self, model_name: str) -> list:
         """
         Return Table permission for the specific user
@@ -95,12 +215,11 @@ class DbConfig:
         query = text(
             f"""SELECT privilege_type FROM information_schema.table_privileges WHERE table_name = '{model_name}' AND grantee = '{self._user}'"""
         )
+        engine = self.get_engine()
         try:
-            engine = sql.create_engine(self.database_connection_url)
             with engine.connect() as connection:
                 result = connection.execute(query)
                 privileges = [row[0] for row in result.fetchall()]
-            engine.dispose()
             return privileges
         except DatabaseInfoError as ex:
             raise Exception(
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config.settings import (
+    DB_ASYNC_MODE,
+    DB_CONNECT_TIMEOUT,
+    DB_ENGINE_IDLE_TIMEOUT,
+    DB_ENGINE_REGISTRY_SIZE,
+    DB_MAX_CONNECTIONS,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+)
+
+
+class EngineRegistry:
+    """
+    Process-wide registry of pooled SQLAlchemy engines.
+
+    Engines are keyed by (host, port, database, user, credential hash) so every tenant
+    reuses its own connection pool instead of paying a fresh connect on every call.
+    The least recently used idle engines are disposed when the registry is full, when
+    they have been idle longer than `DB_ENGINE_IDLE_TIMEOUT`, or when a new engine would
+    exceed the global `DB_MAX_CONNECTIONS` budget.
+    """
+
+    __instance = None
+
+    def __new__(cls):
+        """
+        Singleton: Return Single Unique Instance
+        """
+
+        if cls.__instance is None:
+            cls.__instance = super().__new__(cls)
+            cls.__instance._engines = OrderedDict()
+            cls.__instance._lock = threading.RLock()
+        return cls.__instance
+
+    @staticmethod
+    def make_key(host: str, port: str, database: str, user: str, password: str):
+        """Return the registry key for a set of connection credentials"""
+        credential_hash = hashlib.sha256(f"{user}:{password}".encode("utf-8")).hexdigest()
+        return host, str(port), database, user, credential_hash
+
+    @staticmethod
+    def connections_per_engine() -> int:
+        """Maximum number of connections a single engine can open"""
+        return DB_POOL_SIZE + DB_MAX_OVERFLOW
+
+    def get_engine(self, key: tuple, url: str, connect_args: dict = None):
+        """
+        Return the pooled engine registered for `key`, creating it if required.
+
+        With an async driver this is the `sync_engine` of the registered `AsyncEngine`,
+        which has to be used from inside a SQLAlchemy greenlet (see `DatabaseExecutor`).
+        """
+        return self._get_entry(key, url, connect_args)["engine"]
+
+    def get_async_engine(self, key: tuple, url: str, connect_args: dict = None):
+        """Return the pooled `AsyncEngine` registered for `key` (async drivers only)"""
+        return self._get_entry(key, url, connect_args)["async_engine"]
+
+    def _get_entry(self, key: tuple, url: str, connect_args: dict = None):
+        with self._lock:
+            entry = self._engines.get(key)
+            if entry is None:
+                self._evict_idle()
+                self._reserve_connections()
+                entry = self._create_entry(url, connect_args)
+                self._engines[key] = entry
+                logging.info(
+                    f"Engine created for database: {key[2]} user: {key[3]} "
+                    f"({len(self._engines)} engines registered)"
+                )
+            else:
+                self._engines.move_to_end(key)
+            entry["last_used"] = time.monotonic()
+            return entry
+
+    @staticmethod
+    def _create_entry(url: str, connect_args: dict = None):
+        options = dict(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+        if DB_ASYNC_MODE:
+            if connect_args is None:
+                connect_args = {"timeout": DB_CONNECT_TIMEOUT}
+            async_engine = create_async_engine(url, connect_args=connect_args, **options)
+            engine = async_engine.sync_engine
+        else:
+            if connect_args is None:
+                connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT}
+            async_engine = None
+            engine = sql.create_engine(url, connect_args=connect_args, **options)
+        return {"engine": engine, "async_engine": async_engine, "last_used": time.monotonic()}
+
+    def _reserve_connections(self):
+        """Evict idle engines until one more engine fits into the connection budget"""
+        required = self.connections_per_engine()
+        while (
+            len(self._engines) >= DB_ENGINE_REGISTRY_SIZE
+            or self.reserved_connections + required > DB_MAX_CONNECTIONS
+        ):
+            if not self._evict_least_recently_used():
+                raise Exception(
+                    "Database connection budget exhausted. Please try again later.",
+                    {"status_code": 503},
+                )
+
+    def _evict_least_recently_used(self) -> bool:
+        for key, entry in self._engines.items():
+            if entry["engine"].pool.checkedout() == 0:
+                self._dispose(key)
+                return True
+        return False
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for key, entry in list(self._engines.items()):
+            if now - entry["last_used"] < DB_ENGINE_IDLE_TIMEOUT:
+                break
+            if entry["engine"].pool.checkedout() == 0:
+                self._dispose(key)
+
+    def _dispose(self, key: tuple):
+        """
+        Dispose the engine of `key`. Engines of an async driver are closed through the
+        sync engine, so this must run inside a SQLAlchemy greenlet as well.
+        """
+        entry = self._engines.pop(key)
+        entry["engine"].dispose()
+        logging.info(f"Engine disposed for database: {key[2]} user: {key[3]}")
+
+    def dispose_all(self):
+        """Dispose every registered engine"""
+        with self._lock:
+            for key in list(self._engines):
+                self._dispose(key)
+
+    @property
+    def reserved_connections(self) -> int:
+        return len(self._engines) * self.connections_per_engine()
+
+    def stats(self) -> dict:
+        """Return pool statistics of every registered engine"""
+        with self._lock:
+            now = time.monotonic()
+            pools = []
+            for (host, port, database, user, _), entry in reversed(self._engines.items()):
+                pool = entry["engine"].pool
+                pools.append(
+                    {
+                        "host": host,
+                        "port": port,
+                        "database": database,
+                        "user": user,
+                        "pool_size": pool.size(),
+                        "checked_in": pool.checkedin(),
+                        "checked_out": pool.checkedout(),
+                        "overflow": pool.overflow(),
+                        "idle_seconds": round(now - entry["last_used"], 3),
+                    }
+                )
+            return {
+                "engines": len(self._engines),
+                "max_engines": DB_ENGINE_REGISTRY_SIZE,
+                "reserved_connections": self.reserved_connections,
+                "max_connections": DB_MAX_CONNECTIONS,
+                "pools": pools,
+            }
@@ -0,0 +1,69 @@
+"""
+    RequestContext
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from exceptions.custom_exceptions import DatabaseInfoError
+
+_current_context = ContextVar("request_context", default=None)
+
+
+@dataclass(frozen=True)
+class RequestContext:
+    """
+    Immutable database connection context of a request.
+
+    The `database_info` of the request is parsed and validated once, by
+    `UrlVerificationMiddleware`, and the context is bound to a context variable for the
+    rest of the request: `DbConfig`, the models and the model / schema factories read the
+    database, table and credentials from it, and the handlers read the parsed payload. The
+    context variable is copied into the executor threads running the database calls, so
+    concurrent requests never share a context.
+    """
+
+    database_name: str
+    username: str
+    password: str = field(repr=False)
+    table_name: Optional[str] = None
+    payload: Mapping = field(default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def from_payload(cls, payload: dict, table_required: bool = True):
+        """Validate the `database_info` of a parsed request payload and return its context"""
+        database_info = (payload or {}).get("database_info") or {}
+        if not payload or not (database_info.get("table_name") or not table_required):
+            raise DatabaseInfoError("Missing required database information")
+        if not database_info.get("username") or not database_info.get("password"):
+            raise Exception(
+                "Missing required user or password information. Please check the request JSON body and ensure that all required keys are provided with correct spelling and complete data.",
+                {"status_code": 404},
+            )
+        return cls(
+            database_name=database_info.get("database_name"),
+            username=database_info.get("username"),
+            password=database_info.get("password"),
+            table_name=database_info.get("table_name") or None,
+            payload=MappingProxyType(payload),
+        )
+
+    @staticmethod
+    def current():
+        """Return the context of the current request, None outside of a request"""
+        return _current_context.get()
+
+    def activate(self):
+        """Bind the context to the current request (or task) and return it"""
+        _current_context.set(self)
+        return self
+
+    @property
+    def model_name(self) -> Optional[str]:
+        """Name of the requested table as used by the models, e.g. `order-items` -> `order_items`"""
+        if self.table_name is None:
+            return None
+        return "_".join(self.table_name.split("-")).lower()
@@ -1,4 +1,5 @@
 from dotenv import load_dotenv
+import json
 import os
 
 load_dotenv()
@@ -20,11 +21,72 @@ PASSWORD_SALT = os.getenv("PASSWORD_SALT", "db_manager")
 # DB_USER = os.environ.get("DB_USERNAME", "postgres")
 # DB_PASS = os.environ.get("DB_PASSWORD", "postgres")
 DB_ENGINE = os.environ.get("DB_ENGINE", "postgresql+psycopg2")
+# Native asyncio execution is enabled by an async driver, e.g. postgresql+asyncpg
+DB_ASYNC_MODE = DB_ENGINE.endswith("+asyncpg")
 DB_APPLICATION_NAME = os.environ.get("DB_APPLICATION_NAME", None)
 DB_HOST = os.environ.get("DB_HOST", "localhost")
 DB_PORT = os.environ.get("DB_PORT", "5432")
 
+# Connection pool configurations (per tenant engine)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", "30"))  # seconds
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))  # seconds
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", "60"))  # seconds
+# Engine registry configurations (process wide)
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", "300"))
+DB_ENGINE_REGISTRY_SIZE = int(os.environ.get("DB_ENGINE_REGISTRY_SIZE", "20"))
+DB_ENGINE_IDLE_TIMEOUT = int(os.environ.get("DB_ENGINE_IDLE_TIMEOUT", "600"))  # seconds
+# Worker threads running the synchronous database calls of the request handlers
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", "20"))
+
+# Reflection cache configurations
+REFLECTION_CACHE_TTL = int(os.environ.get("REFLECTION_CACHE_TTL", "3600"))  # seconds
+REFLECTION_VERSION_CHECK_INTERVAL = int(
+    os.environ.get("REFLECTION_VERSION_CHECK_INTERVAL", "30")
+)  # seconds
+
+# Maximum number of generated model classes kept in memory
+MODEL_REGISTRY_SIZE = int(os.environ.get("MODEL_REGISTRY_SIZE", "1000"))
+# Seconds a retired model class is kept before its mapper is disposed
+MODEL_DISPOSE_DELAY = int(os.environ.get("MODEL_DISPOSE_DELAY", "300"))
+
+# Number of rows inserted per statement and transaction by /bulk/create
+BULK_CREATE_CHUNK_SIZE = int(os.environ.get("BULK_CREATE_CHUNK_SIZE", "1000"))
+# Number of rows fetched per round trip by streamed /get responses
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", "1000"))
+# Number of converted request body chunks buffered ahead of COPY by /bulk/copy
+COPY_QUEUE_SIZE = int(os.environ.get("COPY_QUEUE_SIZE", "16"))
+# Number of rejected rows reported back by /bulk/copy
+COPY_REJECTED_SAMPLES = int(os.environ.get("COPY_REJECTED_SAMPLES", "100"))
+# Maximum number of characters of a CSV record (or line) buffered by /bulk/copy
+COPY_MAX_RECORD_SIZE = int(os.environ.get("COPY_MAX_RECORD_SIZE", "1048576"))
+# Maximum number of filter statements cached by shape (see DynamicFilter)
+STATEMENT_CACHE_SIZE = int(os.environ.get("STATEMENT_CACHE_SIZE", "500"))
+# Maximum number of operations of a /batch request
+BATCH_MAX_OPERATIONS = int(os.environ.get("BATCH_MAX_OPERATIONS", "100"))
+
+# Databases reflected at application start, as a JSON list of
+# {"database_name": "", "username": "", "password": "", "tables": [] (optional)}
+WARMUP_DATABASES = json.loads(os.environ.get("WARMUP_DATABASES", "[]"))
+
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", "6379"))
+
+# Cache of the /get, /get_count_rows and /schema responses, "active" to enable it
+RESULT_CACHE_STATUS = os.environ.get("RESULT_CACHE_STATUS", "INACTIVE").lower()
+# Comma separated cache tiers: "local" (per worker memory) and / or "redis" (shared)
+RESULT_CACHE_TIERS = [
+    tier.strip().lower()
+    for tier in os.environ.get("RESULT_CACHE_TIERS", "local,redis").split(",")
+    if tier.strip()
+]
+# Maximum size in bytes of the responses kept in the memory of a worker
+RESULT_CACHE_LOCAL_SIZE = int(os.environ.get("RESULT_CACHE_LOCAL_SIZE", "67108864"))
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", "30"))  # seconds
+# Per table TTLs in seconds overriding RESULT_CACHE_TTL, as a JSON object
+# {"table_name": ttl}, a TTL of 0 disables the cache for the table
+RESULT_CACHE_TABLE_TTLS = json.loads(os.environ.get("RESULT_CACHE_TABLE_TTLS", "{}"))
 
 AUTHORIZATION_STATUS = os.environ.get("AUTHORIZATION_STATUS", "INACTIVE").lower()
 # DB_CONNECT_URL = f'{DB_ENGINE}://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
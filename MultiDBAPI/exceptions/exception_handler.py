@@ -27,5 +27,7 @@ def handle_exception(ex: Exception, payload: dict):
             status=403,
             data=f"Password authentication failed for user: {payload.get('database_info', {}).get('username')} for the database name: {payload.get('database_info', {}).get('database_name')}",
         )
+    elif len(ex.args) >= 2 and isinstance(ex.args[1], dict):
+        return make_response(data=ex)
     else:
         return make_response(status=400, data=str(ex))
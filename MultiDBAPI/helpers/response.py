@@ -1,8 +1,23 @@
-from blacksheep.server.responses import status_code
 import logging
 
+import orjson
+from blacksheep import Content, Response, StreamedContent
+from blacksheep.server.responses import status_code
+
+from serializers.row_encoder import ARROW, JSON, MSGPACK, RowEncoder, json_default
+from services.executor import DatabaseExecutor
+
 
-def make_response(status=200, data=None):
+""" Response media types of the row encoders by Accept header media type """
+MEDIA_TYPES = {
+    "application/json": JSON,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.apache.arrow.stream": ARROW,
+}
+
+
+def make_response(status=200, data=None, content_type=JSON):
     try:
         if isinstance(data, Exception):
             arguments = data.args
@@ -15,4 +30,74 @@ def make_response(status=200, data=None):
     except Exception as ex:
         logging.error(f"Exception happened from make response function : {ex}")
 
+    if isinstance(data, bytes):
+        #   Already encoded by a `RowEncoder`
+        return Response(status, None, Content(content_type.encode("utf-8"), data))
+    if isinstance(data, (dict, list)):
+        return Response(
+            status,
+            None,
+            Content(b"application/json", orjson.dumps(data, default=json_default)),
+        )
     return status_code(status, message=data)
+
+
+def negotiate_media_type(request) -> str:
+    """
+    Return the row encoder media type preferred by the Accept header of the request,
+    JSON if it accepts none of them. Raises a 406 error if the preferred media type is
+    not available on the server.
+    """
+    accept = b",".join(request.headers.get(b"Accept"))
+    media_type, preference = JSON, 0.0
+    for item in accept.decode("latin-1").split(","):
+        accepted, *parameters = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            if parameter.startswith("q="):
+                try:
+                    quality = float(parameter[2:])
+                except ValueError:
+                    pass
+        if accepted in MEDIA_TYPES and quality > preference:
+            media_type, preference = MEDIA_TYPES[accepted], quality
+
+    if not RowEncoder.is_supported(media_type):
+        raise Exception(f"Media type not available: {media_type}", {"status_code": 406})
+    return media_type
+
+
+def encode_ndjson_chunk(chunks, encoder, fields=None):
+    """Fetch the next chunk of rows and encode it as NDJSON, None when exhausted"""
+    chunk = next(chunks, None)
+    if chunk is None:
+        return None
+    return encoder.dumps_ndjson(chunk, fields)
+
+
+async def make_stream_response(chunks, encoder, status=200, fields=None):
+    """
+    Return a chunked NDJSON response of a generator of row lists running synchronous
+    database code (e.g. `Model.stream_objects`), encoded by the `RowEncoder` of the table
+    and restricted to `fields` if given. The first chunk is fetched before the response
+    is started, so query errors are still reported with an error status. Every next
+    chunk is fetched once the previous one has been written.
+    """
+    executor = DatabaseExecutor()
+    try:
+        first_chunk = await executor.run(encode_ndjson_chunk, chunks, encoder, fields)
+    except Exception:
+        await executor.run(chunks.close)
+        raise
+
+    async def stream():
+        try:
+            chunk = first_chunk
+            while chunk is not None:
+                if chunk:
+                    yield chunk
+                chunk = await executor.run(encode_ndjson_chunk, chunks, encoder, fields)
+        finally:
+            await executor.run(chunks.close)
+
+    return Response(status, None, StreamedContent(b"application/x-ndjson", stream))
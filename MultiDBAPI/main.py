@@ -1,4 +1,6 @@
+import asyncio
 import logging
+from typing import List, Optional
 from blacksheep import Application, Request
 from blacksheep.server.authorization import Policy, auth
 from blacksheep.server.controllers import Controller
@@ -7,13 +9,27 @@ from openapidocs.v3 import Info
 from pydantic import BaseModel
 
 from config.authenticator import CentralAuthHandler
+from config.engine_registry import EngineRegistry
+from config.request_context import RequestContext
 from config.log_config import handler
-from config.settings import DOCS_DESCRIPTION, SECRET_KEY
-from helpers.response import make_response
-from middlewares.middlewares import DBGenerationMiddleware, UrlVerificationMiddleware
+from config.settings import DOCS_DESCRIPTION, SECRET_KEY, WARMUP_DATABASES
+from helpers.response import make_response, make_stream_response, negotiate_media_type
+from middlewares.middlewares import (
+    DBGenerationMiddleware,
+    FromRequestContext,
+    UrlVerificationMiddleware,
+)
 from models import CustomDerivedModelFactory
 from schemas import CustomDerivedSchemaFactory
 from serializers import serializers
+from serializers.row_encoder import RowEncoder
+from services.batch import run_batch
+from services.copy_loader import copy_from_stream
+from services.dynamic_filter import DynamicFilter
+from services.executor import DatabaseExecutor
+from services.reflection_cache import ReflectionCache
+from services.result_cache import ResultCache
+from services.warmup import warm_up_configured_database, warm_up_database
 from exceptions.exception_handler import handle_exception
 
 app = Application()
@@ -37,9 +53,50 @@ app.use_authentication().add(CentralAuthHandler())
 authorization = app.use_authorization()
 Authenticated = "authenticated"
 authorization += Policy(Authenticated)
+COPY_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+}
 logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
 
 
+async def dispose_engines(application: Application):
+    await DatabaseExecutor().run(EngineRegistry().dispose_all)
+    DatabaseExecutor().shutdown()
+
+
+async def start_result_cache(application: Application):
+    await ResultCache().start()
+
+
+async def stop_result_cache(application: Application):
+    await ResultCache().stop()
+
+
+async def warm_up_databases(application: Application):
+    # Every database is warmed up in its own task, so the DbConfig of one does not
+    # leak into the context of the application or of another database
+    results = await asyncio.gather(
+        *[
+            DatabaseExecutor().run(warm_up_configured_database, database)
+            for database in WARMUP_DATABASES
+        ],
+        return_exceptions=True,
+    )
+    for database, result in zip(WARMUP_DATABASES, results):
+        if isinstance(result, Exception):
+            logging.error(
+                f"Warm up failed for database: {database.get('database_name')} : {result}"
+            )
+
+
+app.on_start += warm_up_databases
+app.on_start += start_result_cache
+app.on_stop += stop_result_cache
+app.on_stop += dispose_engines
+
+
 class DatabaseInfo(BaseModel):
     database_name: str
     table_name: str
@@ -51,32 +108,101 @@ class GetRequestSchema(BaseModel):
     database_info: DatabaseInfo
 
 
+class WarmUpDatabaseInfo(BaseModel):
+    database_name: str
+    username: str
+    password: str
+
+
+class WarmUpRequestSchema(BaseModel):
+    database_info: WarmUpDatabaseInfo
+    tables: Optional[List[str]]
+
+
+class BatchDatabaseInfo(BaseModel):
+    database_name: str
+    table_name: Optional[str]
+    username: str
+    password: str
+
+
+class BatchOperationSchema(BaseModel):
+    op: str
+    table: Optional[str]
+    id: Optional[str]
+    data: Optional[dict]
+    query: Optional[dict]
+
+
+class BatchRequestSchema(BaseModel):
+    database_info: BatchDatabaseInfo
+    operations: List[BatchOperationSchema]
+    savepoints: Optional[bool]
+
+
 class Generic_Request_Handler(Controller):
     @auth(Authenticated)
     @post("/get")
-    async def get(self, request: Request, payload: GetRequestSchema):
+    async def get(
+        self, request: Request, payload: FromRequestContext[GetRequestSchema]
+    ):
         """This Request Handler handles the retrieval of existing resources."""
 
         try:
-            payload = await request.json()
+            payload = payload.value
 
             #   Generate Custom Derived Model
             #   Get Object or Create Object
-            table_name = payload.get("database_info", {}).get("table_name")
+            table_name = RequestContext.current().table_name
 
-            DerivedModel = CustomDerivedModelFactory.get_custom_derived_model(
-                table_name.capitalize()
+            DerivedModel = await DatabaseExecutor().run(
+                CustomDerivedModelFactory.get_custom_derived_model
             )
 
-            query = request.query
-            data = DerivedModel.get_all_objects(**query)
+            query = dict(request.query)
+            fields = DynamicFilter.parse_fields(query.get("fields"))
+            #   Response parameters are popped before the query reaches the Dynamic Filter
+            stream = query.pop("stream", [None])[0]
+            with_total = query.pop("with_total", ["false"])[0].lower() in ["true", "1", "yes"]
+            shape = query.pop("shape", ["rows"])[0]
+            if shape not in ["rows", "columns"]:
+                raise Exception(f"Unsupported shape: {shape}", {"status_code": 400})
+
+            encoder = RowEncoder.for_table(DerivedModel.__table__)
+            if stream == "ndjson":
+                if with_total or shape != "rows":
+                    raise Exception(
+                        "with_total and shape=columns are not supported with stream",
+                        {"status_code": 400},
+                    )
+                chunks = DerivedModel.stream_objects(**query)
+                return await make_stream_response(chunks, encoder, fields=fields)
+            elif stream is not None:
+                raise Exception(
+                    f"Unsupported stream format: {stream}", {"status_code": 400}
+                )
+
+            media_type = negotiate_media_type(request)
 
-            #   Generate Custom Derived Model
-            #   Get Object or Create Object
-            serializer = serializers.GenericSerializer(data, many=True)
-            serialized_data = serializer.data
+            #   Read through the result cache
+            cache_key = await ResultCache().key(request, table_name, media_type)
+            response = await ResultCache().get(cache_key)
+            if response is not None:
+                return response
 
-            return make_response(status=200, data=serialized_data)
+            data, page_info = await DatabaseExecutor().run(
+                DerivedModel.get_objects_page, with_total=with_total, **query
+            )
+
+            #   Encode the rows with the compiled encoder of the table
+            encoded_data = encoder.encode(
+                data, fields, media_type, page_info if with_total else None, shape
+            )
+            response = make_response(status=200, data=encoded_data, content_type=media_type)
+            response.add_header(b"Vary", b"Accept")
+            if page_info["next"] and not with_total:
+                response.add_header(b"X-Next-Cursor", page_info["next"].encode("utf-8"))
+            return await ResultCache().set(cache_key, table_name, response)
 
         except Exception as ex:
             logging.error(f"Exception happened from PATCH view function : {ex}")
@@ -84,17 +210,19 @@ class Generic_Request_Handler(Controller):
 
     @auth(Authenticated)
     @post("/create")
-    async def create(self, request: Request, payload: GetRequestSchema):
+    async def create(
+        self, request: Request, payload: FromRequestContext[GetRequestSchema]
+    ):
         """This Request Handler handles the creation of new resources."""
         try:
-            payload = await request.json()
+            payload = payload.value
 
             #   Generate Custom Derived Schema
             #   Validate and Structure Payload Through Schema
-            table_name = payload.get("database_info", {}).get("table_name")
+            table_name = RequestContext.current().table_name
 
-            DerivedSchema = CustomDerivedSchemaFactory.get_custom_derived_model(
-                table_name.capitalize()
+            DerivedSchema = await DatabaseExecutor().run(
+                CustomDerivedSchemaFactory.get_custom_derived_model
             )
             data_payload = payload.get("data")
             if not data_payload:
@@ -104,11 +232,14 @@ class Generic_Request_Handler(Controller):
 
             #   Generate Custom Derived Model
             #   Get Object or Create Object
-            DerivedModel = CustomDerivedModelFactory.get_custom_derived_model(
-                table_name.capitalize()
+            DerivedModel = await DatabaseExecutor().run(
+                CustomDerivedModelFactory.get_custom_derived_model
             )
 
-            obj, already_exist = DerivedModel.get_or_create(**data_payload.dict())
+            obj, already_exist = await DatabaseExecutor().run(
+                DerivedModel.get_or_create, **data_payload.dict()
+            )
+            await ResultCache().invalidate(table_name)
 
             #   Serialized Object Data
             serializer = serializers.GenericSerializer(obj)
@@ -123,17 +254,19 @@ class Generic_Request_Handler(Controller):
 
     @auth(Authenticated)
     @post("/bulk/create")
-    async def bulk_create(self, request: Request, payload: GetRequestSchema):
+    async def bulk_create(
+        self, request: Request, payload: FromRequestContext[GetRequestSchema]
+    ):
         """This Request Handler handles the bulk creation of new resources for list of dict."""
         try:
-            payload = await request.json()
+            payload = payload.value
 
             #   Generate Custom Derived Schema
             #   Validate annd Structure Payload Through Schema
-            table_name = payload.get("database_info", {}).get("table_name")
+            table_name = RequestContext.current().table_name
 
-            DerivedSchema = CustomDerivedSchemaFactory.get_custom_derived_model(
-                table_name.capitalize()
+            DerivedSchema = await DatabaseExecutor().run(
+                CustomDerivedSchemaFactory.get_custom_derived_model
             )
             data_payload = payload.get("data")
             if not data_payload:
@@ -144,10 +277,13 @@ class Generic_Request_Handler(Controller):
 
             #   Generate Custom Derived Model
             #   Get Object or Create Object
-            DerivedModel = CustomDerivedModelFactory.get_custom_derived_model(
-                table_name.capitalize()
+            DerivedModel = await DatabaseExecutor().run(
+                CustomDerivedModelFactory.get_custom_derived_model
             )
-            obj, failed_instances = DerivedModel.get_or_create_bulk(data_payload)
+            obj, failed_instances = await DatabaseExecutor().run(
+                DerivedModel.get_or_create_bulk, data_payload
+            )
+            await ResultCache().invalidate(table_name)
             #   Serialized Object Data
             serializer = serializers.GenericSerializer(obj, many=True)
             serialized_data = serializer.data
@@ -159,19 +295,131 @@ class Generic_Request_Handler(Controller):
 
             return handle_exception(ex=ex, payload=payload)
 
+    @auth(Authenticated)
+    @post("/bulk/copy")
+    async def bulk_copy(self, request: Request):
+        """
+        This Request Handler streams a CSV (`text/csv`) or NDJSON (`application/x-ndjson`) payload
+        into the table with COPY. The `database_info` is sent in the X-Database-Name, X-Table-Name,
+        X-Database-Username and X-Database-Password headers.
+        `rows_rejected` only counts structural errors (wrong number of fields, invalid JSON, records
+        longer than COPY_MAX_RECORD_SIZE): a value the column type does not accept aborts the whole COPY.
+        """
+        context = RequestContext.current()
+        payload = context.payload
+        try:
+            table_name = context.model_name
+            data_format = request.query.get("format", [None])[0]
+            if data_format is None:
+                content_type = (request.content_type() or b"").decode("utf-8")
+                data_format = COPY_CONTENT_TYPES.get(content_type.split(";")[0].strip())
+
+            table_columns = await DatabaseExecutor().run(
+                ReflectionCache().get_columns, table_name
+            )
+            result = await copy_from_stream(
+                table_name, table_columns, data_format or "", request.stream
+            )
+            await ResultCache().invalidate(table_name)
+            return make_response(status=201, data=result)
+
+        except Exception as ex:
+            logging.error(f"Exception happened from COPY view function : {ex}")
+
+            return handle_exception(ex=ex, payload=payload)
+
+    @auth(Authenticated)
+    @patch("/bulk/update")
+    async def bulk_update(
+        self, request: Request, payload: FromRequestContext[GetRequestSchema]
+    ):
+        """
+        This Request Handler updates the resources matching the query parameters with a single
+        statement. The `max_rows` query parameter is required: the update is rolled back if it
+        matches more rows.
+        """
+        try:
+            payload = payload.value
+
+            #   Generate Custom Derived Schema
+            #   Validate and Structure Payload Through Schema
+            table_name = RequestContext.current().table_name
+
+            DerivedSchema = await DatabaseExecutor().run(
+                CustomDerivedSchemaFactory.get_custom_derived_model
+            )
+            data_payload = payload.get("data")
+            if not data_payload:
+                raise Exception("Data payload is empty")
+
+            data_payload = DerivedSchema(**data_payload)
+
+            #   Generate Custom Derived Model
+            #   Update Objects Matching the Filters
+            DerivedModel = await DatabaseExecutor().run(
+                CustomDerivedModelFactory.get_custom_derived_model
+            )
+            query = dict(request.query)
+            max_rows = query.pop("max_rows", [None])[0]
+
+            ids = await DatabaseExecutor().run(
+                DerivedModel.bulk_update, data_payload.dict(), max_rows, **query
+            )
+            await ResultCache().invalidate(table_name)
+
+            return make_response(status=202, data={"count": len(ids), "ids": ids})
+
+        except Exception as ex:
+            logging.error(f"Exception happened from Bulk Update view function : {ex}")
+            return handle_exception(ex=ex, payload=payload)
+
+    @auth(Authenticated)
+    @delete("/bulk/delete")
+    async def bulk_delete(
+        self, request: Request, payload: FromRequestContext[GetRequestSchema]
+    ):
+        """
+        This Request Handler deletes the resources matching the query parameters with a single
+        statement. The `max_rows` query parameter is required: the delete is rolled back if it
+        matches more rows.
+        """
+        try:
+            payload = payload.value
+
+            #   Generate Custom Derived Model
+            #   Delete Objects Matching the Filters
+            table_name = RequestContext.current().table_name
+
+            DerivedModel = await DatabaseExecutor().run(
+                CustomDerivedModelFactory.get_custom_derived_model
+            )
+            query = dict(request.query)
+            max_rows = query.pop("max_rows", [None])[0]
+
+            ids = await DatabaseExecutor().run(DerivedModel.bulk_delete, max_rows, **query)
+            await ResultCache().invalidate(table_name)
+
+            return make_response(status=202, data={"count": len(ids), "ids": ids})
+
+        except Exception as ex:
+            logging.error(f"Exception happened from Bulk Delete view function : {ex}")
+            return handle_exception(ex=ex, payload=payload)
+
     @auth(Authenticated)
     @patch("/update/{id}")
-    async def update(self, request: Request, id: str, payload: GetRequestSchema):
+    async def update(
+        self, request: Request, id: str, payload: FromRequestContext[GetRequestSchema]
+    ):
         """This Request Handler handles the updating of existing resources."""
         try:
-            payload = await request.json()
+            payload = payload.value
 
             #   Generate Custom Derived Schema
             #   Validate annd Structure Payload Through Schema
-            table_name = payload.get("database_info", {}).get("table_name")
+            table_name = RequestContext.current().table_name
 
-            DerivedSchema = CustomDerivedSchemaFactory.get_custom_derived_model(
-                table_name.capitalize()
+            DerivedSchema = await DatabaseExecutor().run(
+                CustomDerivedSchemaFactory.get_custom_derived_model
             )
             data_payload = payload.get("data")
             if not data_payload:
@@ -180,22 +428,24 @@ class Generic_Request_Handler(Controller):
             data_payload = DerivedSchema(**data_payload)
 
             #   Generate Custom Derived Model
-            #   Get Object then Update Object
-            DerivedModel = CustomDerivedModelFactory.get_custom_derived_model(
-                table_name.capitalize()
+            #   Update Object and Return the Updated Row
+            DerivedModel = await DatabaseExecutor().run(
+                CustomDerivedModelFactory.get_custom_derived_model
+            )
+            row = await DatabaseExecutor().run(
+                DerivedModel.update_by_id, id, **data_payload.dict()
             )
-            obj, session = DerivedModel.get_single_object(id=id)
 
             #   Return 400 If No object Found
-            if not obj:
+            if row is None:
                 return make_response(
                     status=400, data="No matching data found for the specified id."
                 )
 
-            obj.update(session, **data_payload.dict())
+            await ResultCache().invalidate(table_name)
 
             #   Serialize Object Data
-            serializer = serializers.GenericSerializer(obj)
+            serializer = serializers.GenericSerializer(row)
             serialized_data = serializer.data
 
             return make_response(status=202, data=serialized_data)
@@ -207,29 +457,31 @@ class Generic_Request_Handler(Controller):
 
     @auth(Authenticated)
     @delete("/delete/{id}")
-    async def delete(self, request: Request, id: str, payload: GetRequestSchema):
+    async def delete(
+        self, request: Request, id: str, payload: FromRequestContext[GetRequestSchema]
+    ):
         """This Request Handler handles the deletion of existing resources."""
 
         try:
-            payload = await request.json()
+            payload = payload.value
 
             #   Generate Custom Derived Model
-            #   Get Object then Delete Object
-            table_name = payload.get("database_info", {}).get("table_name")
+            #   Delete Object
+            table_name = RequestContext.current().table_name
 
-            DerivedModel = CustomDerivedModelFactory.get_custom_derived_model(
-                table_name.capitalize()
+            DerivedModel = await DatabaseExecutor().run(
+                CustomDerivedModelFactory.get_custom_derived_model
             )
 
-            obj, session = DerivedModel.get_single_object(id=id)
+            deleted_id = await DatabaseExecutor().run(DerivedModel.delete_by_id, id)
 
             #   Return 400 If No object Found
-            if not obj:
+            if deleted_id is None:
                 return make_response(
                     status=400, data="No matching data found for the specified id."
                 )
 
-            obj.delete(session)
+            await ResultCache().invalidate(table_name)
 
             return make_response(status=202, data="Object deleted successfully.")
         except Exception as ex:
@@ -237,19 +489,56 @@ class Generic_Request_Handler(Controller):
             return handle_exception(ex=ex, payload=payload)
 
 
+    @auth(Authenticated)
+    @post("/batch")
+    async def batch(
+        self, request: Request, payload: FromRequestContext[BatchRequestSchema]
+    ):
+        """
+        This Request Handler executes an ordered list of get / create / update / delete operations
+        against the tables of the database in one transaction, and returns their results in order.
+        """
+        try:
+            payload = payload.value
+
+            results = await DatabaseExecutor().run(
+                run_batch, payload.get("operations"), bool(payload.get("savepoints"))
+            )
+            for table_name in dict.fromkeys(
+                result["table"]
+                for result in results
+                if result["op"] != "get" and "Error" not in result
+            ):
+                await ResultCache().invalidate(table_name)
+
+            return make_response(status=200, data=results)
+        except Exception as ex:
+            logging.error(f"Exception happened from Batch view function : {ex}")
+            return handle_exception(ex=ex, payload=payload)
+
+
 class Schema(Controller):
     @auth(Authenticated)
     @post("/schema")
-    async def get_table_schema(self, request: Request, payload: GetRequestSchema):
+    async def get_table_schema(
+        self, request: Request, payload: FromRequestContext[GetRequestSchema]
+    ):
         """This Request Handler will return schema of given table"""
         try:
-            payload = await request.json()
+            payload = payload.value
 
-            table_name = payload.get("database_info", {}).get("table_name")
+            table_name = RequestContext.current().table_name
 
-            schema = CustomDerivedSchemaFactory.get_schema(table_name.lower())
+            #   Read through the result cache
+            cache_key = await ResultCache().key(request, table_name)
+            response = await ResultCache().get(cache_key)
+            if response is not None:
+                return response
 
-            return make_response(status=200, data=schema)
+            schema = await DatabaseExecutor().run(CustomDerivedSchemaFactory.get_schema)
+
+            response = make_response(status=200, data=schema)
+            return await ResultCache().set(cache_key, table_name, response)
 
         except Exception as ex:
             logging.error(f"Exception happened from PATCH view function : {ex}")
@@ -260,26 +549,100 @@ class Schema(Controller):
 class MetaData(Controller):
     @auth(Authenticated)
     @post("/get_count_rows")
-    async def get_count_rows(self, request: Request, payload: GetRequestSchema):
+    async def get_count_rows(
+        self, request: Request, payload: FromRequestContext[GetRequestSchema]
+    ):
         """This Request Handler will return number rows of given table"""
         try:
-            payload = await request.json()
+            payload = payload.value
 
             #   Generate Custom Derived Model
             #   Get Object or Create Object
-            table_name = payload.get("database_info", {}).get("table_name")
+            table_name = RequestContext.current().table_name
+
+            DerivedModel = await DatabaseExecutor().run(
+                CustomDerivedModelFactory.get_custom_derived_model
+            )
+            query = dict(request.query)
+            estimate = query.pop("estimate", ["false"])[0].lower() in ["true", "1", "yes"]
+
+            #   Read through the result cache
+            cache_key = await ResultCache().key(request, table_name)
+            response = await ResultCache().get(cache_key)
+            if response is not None:
+                return response
 
-            DerivedModel = CustomDerivedModelFactory.get_custom_derived_model(
-                table_name.capitalize()
+            data = await DatabaseExecutor().run(
+                DerivedModel.get_count, estimate=estimate, **query
             )
-            query = request.query
-            data = DerivedModel.get_count(**query)
 
-            return make_response(status=200, data={"count": data})
+            response = make_response(status=200, data={"count": data})
+            return await ResultCache().set(cache_key, table_name, response)
         except Exception as ex:
             logging.error(f"Exception happened from Get Count view function : {ex}")
             return handle_exception(ex=ex, payload=payload)
 
 
+class Admin(Controller):
+    @auth(Authenticated)
+    @post("/admin/warmup")
+    async def warmup(
+        self, request: Request, payload: FromRequestContext[WarmUpRequestSchema]
+    ):
+        """This Request Handler will reflect the tables of the given database in bulk and pre-build their models and schemas"""
+        try:
+            payload = payload.value
+
+            table_names = payload.get("tables") or None
+            summary = await DatabaseExecutor().run(warm_up_database, table_names)
+
+            return make_response(status=200, data=summary)
+        except Exception as ex:
+            logging.error(f"Exception happened from Warm Up view function : {ex}")
+            return handle_exception(ex=ex, payload=payload)
+
+    @auth(Authenticated)
+    @get("/admin/pool_stats")
+    async def pool_stats(self, request: Request):
+        """This Request Handler will return connection pool statistics of every tenant engine"""
+        try:
+            return make_response(status=200, data=EngineRegistry().stats())
+        except Exception as ex:
+            logging.error(f"Exception happened from Pool Stats view function : {ex}")
+            return make_response(status=400, data=str(ex))
+
+    @auth(Authenticated)
+    @get("/admin/executor_stats")
+    async def executor_stats(self, request: Request):
+        """This Request Handler will return queue depth and wait time metrics of the database executor"""
+        try:
+            return make_response(status=200, data=DatabaseExecutor().stats())
+        except Exception as ex:
+            logging.error(f"Exception happened from Executor Stats view function : {ex}")
+            return make_response(status=400, data=str(ex))
+
+    @auth(Authenticated)
+    @get("/admin/cache_stats")
+    async def cache_stats(self, request: Request):
+        """This Request Handler will return the hit, miss and error counters of the result cache"""
+        try:
+            return make_response(status=200, data=ResultCache().stats())
+        except Exception as ex:
+            logging.error(f"Exception happened from Cache Stats view function : {ex}")
+            return make_response(status=400, data=str(ex))
+
+    @auth(Authenticated)
+    @get("/admin/model_stats")
+    async def model_stats(self, request: Request):
+        """This Request Handler will return the number of generated models, tables and columns kept in memory"""
+        try:
+            stats = CustomDerivedModelFactory.stats()
+            stats["statement_cache"] = DynamicFilter.statement_cache_stats()
+            return make_response(status=200, data=stats)
+        except Exception as ex:
+            logging.error(f"Exception happened from Model Stats view function : {ex}")
+            return make_response(status=400, data=str(ex))
+
+
 if __name__ == "__main__":
     app.start()
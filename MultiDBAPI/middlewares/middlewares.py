@@ -1,39 +1,66 @@
+from typing import TypeVar
+
 from blacksheep import Request, Response, Content
-from config.db import DbConfig
+from blacksheep.server.bindings import BoundValue, JSONBinder
+from config.request_context import RequestContext
 from exceptions.custom_exceptions import DatabaseInfoError
 from helpers.response import make_response
 import logging
 
+T = TypeVar("T")
+
+# Paths served without `database_info` in the request body
+EXEMPT_PATHS = [
+    "/docs",
+    "/openapi.json",
+    "/admin/pool_stats",
+    "/admin/executor_stats",
+    "/admin/model_stats",
+    "/admin/cache_stats",
+]
+# Paths whose `database_info` does not need a `table_name`
+TABLE_OPTIONAL_PATHS = ["/admin/warmup", "/batch"]
+# Paths streaming their request body, `database_info` is sent in headers instead
+STREAMING_PATHS = ["/bulk/copy"]
+DATABASE_INFO_HEADERS = {
+    "database_name": b"X-Database-Name",
+    "table_name": b"X-Table-Name",
+    "username": b"X-Database-Username",
+    "password": b"X-Database-Password",
+}
+
+
+async def get_request_payload(request: Request):
+    """
+    Return the JSON payload of the request. For streaming paths the body is left unread
+    and a payload holding only the `database_info` from the request headers is returned.
+    """
+    if request.path in STREAMING_PATHS:
+        return {
+            "database_info": {
+                key: (request.get_first_header(header) or b"").decode("utf-8")
+                for key, header in DATABASE_INFO_HEADERS.items()
+            }
+        }
+    return await request.json()
+
 
 class UrlVerificationMiddleware:
+    """
+    Parses the payload of the request once, validates its `database_info` and attaches
+    the resulting `RequestContext` to the request.
+    """
+
     async def __call__(self, request: Request, handler):
-        if request.path in ["/docs", "/openapi.json"]:
+        if request.path in EXEMPT_PATHS:
             response = await handler(request)
             return response
 
         try:
-            payload = await request.json()
-            if (not payload) or not (
-                payload.get("database_info", {}).get("table_name")
-                and payload.get("database_info", {}).get("table_name")
-            ):
-                raise DatabaseInfoError("Missing required database information")
-            elif (not payload) or not (
-                payload.get("database_info", {}).get("username")
-                and payload.get("database_info", {}).get("username")
-            ):
-                raise Exception(
-                    "Missing required user or password information. Please check the request JSON body and ensure that all required keys are provided with correct spelling and complete data.",
-                    {"status_code": 404},
-                )
-            elif (not payload) or not (
-                payload.get("database_info", {}).get("password")
-                and payload.get("database_info", {}).get("password")
-            ):
-                raise Exception(
-                    "Missing required user or password information. Please check the request JSON body and ensure that all required keys are provided with correct spelling and complete data.",
-                    {"status_code": 404},
-                )
+            payload = await get_request_payload(request)
+            request.database_context = RequestContext.from_payload(
+                payload, table_required=request.path not in TABLE_OPTIONAL_PATHS
+            )
             response = await handler(request)
             return response
         except DatabaseInfoError as ex:
@@ -46,20 +73,33 @@ class UrlVerificationMiddleware:
 
 
 class DBGenerationMiddleware:
+    """Binds the `RequestContext` of the request, read by `DbConfig`, to its context"""
+
     async def __call__(self, request: Request, handler):
-        if request.path in ["/docs", "/openapi.json"]:
+        if request.path in EXEMPT_PATHS:
             response = await handler(request)
             return response
 
         try:
-            payload = await request.json()
-            database_name = payload.get("database_info", {}).get("database_name")
-            username = payload.get("database_info", {}).get("username")
-            password = payload.get("database_info", {}).get("password")
-            DbConfig().generate_database().set_database_user_pass(
-                database_name=database_name, user_name=username, password=password
-            )
+            request.database_context.activate()
             response = await handler(request)
             return response
         except Exception as ex:
             logging.error("Error encountered")
+
+
+class FromRequestContext(BoundValue[T]):
+    """
+    Request payload already parsed by `UrlVerificationMiddleware`, documented as a JSON
+    body of the annotated type.
+    """
+
+
+class RequestContextBinder(JSONBinder):
+    """Binds the payload of the `RequestContext` instead of parsing the body again"""
+
+    handle = FromRequestContext
+
+    async def get_value(self, request: Request):
+        context = RequestContext.current()
+        return context.payload if context is not None else None
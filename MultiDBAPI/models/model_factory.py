@@ -1,15 +1,37 @@
-from sqlalchemy import Column, Integer
+import resource
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sqlalchemy import Column, Integer, MetaData
+from sqlalchemy.orm import registry
+
 from config.db import DbConfig
-from models.models import Base, Model
+from config.request_context import RequestContext
+from config.settings import MODEL_DISPOSE_DELAY, MODEL_REGISTRY_SIZE
+from models.models import Model
+from services.reflection_cache import ReflectionCache
 
 
 class CustomDerivedModelFactory:
     """
     Factory to generate custom database models.
+
+    Every database and credentials (see `DbConfig.engine_key`) have their own `MetaData`
+    and every generated model its own mapper `registry`, so a model can be disposed on its
+    own and is never served to another user of the database. At most `MODEL_REGISTRY_SIZE` models
+    are kept; the least recently used one is retired when the limit is exceeded. A retired
+    model (or one replaced after a DDL change) leaves the database `MetaData` at once and
+    its mapper is disposed `MODEL_DISPOSE_DELAY` seconds later, once in flight requests
+    using it are done.
     """
 
     __instance = None
-    custom_model_dict = {}
+    __lock = threading.RLock()
+    custom_model_dict = OrderedDict()
+    database_metadata = {}
+    retired_models = deque()
+    evictions = 0
 
     def __new__(cls):
         """
@@ -21,42 +43,119 @@ class CustomDerivedModelFactory:
         return cls.__instance
 
     @classmethod
-    def get_custom_derived_model(cls, class_name: str):
+    def get_custom_derived_model(cls, class_name: str = None):
         """
         Returns a Custom Base Model:
 
-        If the class name is not found in the `custom_model_dict` dictionary,
-        it generates a custom derived Model and adds it to the `custom_model_dict` with it's user permission.
+        If the (engine key, class name) is not found in the `custom_model_dict` dictionary, or the
+        table has been reflected again since the model was generated, it generates a custom
+        derived Model and adds it to the `custom_model_dict`.
         Finally, it returns the model from the `custom_model_dict`.
+        The class name defaults to the table of the `RequestContext`.
         """
+        if class_name is None:
+            class_name = RequestContext.current().table_name.capitalize()
         class_name = "_".join(class_name.split("-"))
-        if not cls.custom_model_dict.get(class_name):
-            cls.custom_model_dict.update(
-                {class_name: cls.custom_derived_model(class_name.lower())}
-            )
-        return cls.custom_model_dict.get(class_name)
+        reflection = ReflectionCache().get(class_name.lower())
+        key = (reflection["engine_key"], class_name)
+
+        with cls.__lock:
+            cls.dispose_retired_models()
+            generation, model = cls.custom_model_dict.get(key, (0, None))
+            if generation < reflection["generation"]:
+                if model is not None:
+                    cls.retire_model(cls.custom_model_dict.pop(key)[1])
+                model = cls.custom_derived_model(
+                    class_name.lower(), reflection["columns"], reflection["engine_key"]
+                )
+                cls.custom_model_dict.update({key: (reflection["generation"], model)})
+                cls.evict_least_recently_used()
+            else:
+                cls.custom_model_dict.move_to_end(key)
+        return model
 
     @classmethod
-    def custom_derived_model(cls, model_name: str):
+    def custom_derived_model(
+        cls, model_name: str, columns: list = None, engine_key: tuple = None
+    ):
         """Generate and Return Custom Model"""
-        table_info = cls.get_table_info(model_name)
-        bases = (
-            Base,
-            Model,
-        )
-        attrs = {
-            "__tablename__": model_name,
-            "__table_args__": {"extend_existing": True},
-            "id": Column(Integer, primary_key=True),
-        }
-        attrs.update(table_info)
-        return type(model_name, bases, attrs)
+        if columns is None:
+            columns = ReflectionCache().get_columns(model_name)
+        if engine_key is None:
+            engine_key = DbConfig().engine_key
+        table_info = cls.get_model_fields_dict(columns)
+
+        with cls.__lock:
+            metadata = cls.database_metadata.setdefault(engine_key, MetaData())
+            # A model generated before a DDL change may still hold the table name
+            if model_name in metadata.tables:
+                metadata.remove(metadata.tables[model_name])
+
+            attrs = {
+                "__tablename__": model_name,
+                "id": Column(Integer, primary_key=True),
+            }
+            attrs.update(table_info)
+            model = type(model_name, (Model,), attrs)
+            registry(metadata=metadata).map_declaratively(model)
+        return model
+
+    @classmethod
+    def evict_least_recently_used(cls):
+        """Retire the least recently used models above `MODEL_REGISTRY_SIZE`"""
+        with cls.__lock:
+            while len(cls.custom_model_dict) > MODEL_REGISTRY_SIZE:
+                key, (generation, model) = cls.custom_model_dict.popitem(last=False)
+                cls.retire_model(model)
+                cls.evictions += 1
+
+    @classmethod
+    def retire_model(cls, model):
+        """Remove the table of the model from its database MetaData and schedule its disposal"""
+        with cls.__lock:
+            table = model.__table__
+            metadata = table.metadata
+            if metadata.tables.get(table.key) is table:
+                metadata.remove(table)
+            for engine_key, database_metadata in list(cls.database_metadata.items()):
+                if database_metadata is metadata and not metadata.tables:
+                    cls.database_metadata.pop(engine_key)
+            cls.retired_models.append((time.monotonic(), model))
+
+    @classmethod
+    def dispose_retired_models(cls):
+        """Dispose the mappers of the models retired more than `MODEL_DISPOSE_DELAY` ago"""
+        with cls.__lock:
+            now = time.monotonic()
+            while cls.retired_models and now - cls.retired_models[0][0] > MODEL_DISPOSE_DELAY:
+                retired_at, model = cls.retired_models.popleft()
+                model.__mapper__.registry.dispose()
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Return the number of models, tables and columns kept per database (all users)"""
+        with cls.__lock:
+            databases = {}
+            for engine_key, metadata in cls.database_metadata.items():
+                database = databases.setdefault(engine_key[2], {"tables": 0, "columns": 0})
+                database["tables"] += len(metadata.tables)
+                database["columns"] += sum(
+                    len(table.columns) for table in metadata.tables.values()
+                )
+            return {
+                "models": len(cls.custom_model_dict),
+                "max_models": MODEL_REGISTRY_SIZE,
+                "evictions": cls.evictions,
+                "retired_models": len(cls.retired_models),
+                "databases": databases,
+                "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
 
     @classmethod
     def get_table_info(cls, tablename: str):
         """Get and Return Table Information from Database after processing"""
         try:
-            columns = DbConfig().get_db_columns(tablename)
+            columns = ReflectionCache().get_columns(tablename)
             model_fields = cls.get_model_fields_dict(columns)
             return model_fields
         except Exception:
@@ -66,7 +165,9 @@ class CustomDerivedModelFactory:
     def get_model_fields_dict(columns):
         """Return Model Field Information as Python Dictionary"""
         return {
-            column["name"]: Column(type(column["type"]), nullable=True)
+            column["name"]: Column(
+                type(column["type"]), nullable=column.get("nullable", True)
+            )
             for column in columns
             if column["name"] not in ["id"]
         }
@@ -1,9 +1,14 @@
 import logging
-from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy import Column, Integer, String, delete, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import MultipleResultsFound, OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker
 from config.db import DbConfig
-from services.dynamic_filter import DynamicFilter
+from config.settings import BULK_CREATE_CHUNK_SIZE, STREAM_CHUNK_SIZE
+from services.dynamic_filter import DynamicFilter, coerce_value
+
+# Query parameters that do not apply to a bulk update or delete
+BULK_WRITE_INVALID_PARAMETERS = ["limit", "offset", "page", "cursor", "sort", "fields"]
 
 Base = declarative_base()
 
@@ -15,12 +20,20 @@ class Model:
     methods:
 
     - get_all_objects:      Retrieve objects from the table using the Dynamic Filter.
-    - create:               Create a new object and store it in the database.
+    - get_objects_page:     Retrieve a page of rows and the cursor of the next page, without the ORM.
+    - stream_objects:       Retrieve rows from the table chunk by chunk through a server side cursor.
+    - create:               Create a new row with `INSERT ... RETURNING` and return the stored row.
     - get_or_create:        Retrieve an object from the database or create a new one if not found.
     - bulk_create:          Retrieve objects from the database or create new if not found.
+    - bulk_update:          Update the rows matching the Dynamic Filter with a single statement.
+    - bulk_delete:          Delete the rows matching the Dynamic Filter with a single statement.
     - get_single_object:    Retrieve a single object from the database based on provided criteria.
-    - update:               Update the attributes of the object in the database.
-    - delete:               Delete the object from the database.
+    - select_rows:          Retrieve rows using the Dynamic Filter on an open connection.
+    - insert_row:           Insert a row with `INSERT ... RETURNING` on an open connection.
+    - update_row:           Update a row by id with `UPDATE ... RETURNING` on an open connection.
+    - delete_row:           Delete a row by id with `DELETE ... RETURNING` on an open connection.
+    - update_by_id:         Update a row by id with a single `UPDATE ... RETURNING` statement.
+    - delete_by_id:         Delete a row by id with a single `DELETE ... RETURNING` statement.
 
     """
 
@@ -37,13 +50,7 @@ class Model:
         """
 
         try:
-            engine = create_engine(
-                DbConfig().database_connection_url,
-                pool_size=100,
-                max_overflow=0,
-                connect_args={"connect_timeout": 60},
-                echo=True,
-            )
+            engine = DbConfig().get_engine()
 
             with sessionmaker(
                 bind=engine, expire_on_commit=True, autoflush=False
@@ -51,10 +58,8 @@ class Model:
                 query_result = DynamicFilter(
                     cls, session=database_session, query=kwargs
                 )
-                result, count, page = query_result.search()
-                result = page.all()
+                result = query_result.paginated_query().all()
 
-            engine.dispose()
             return result
         except OperationalError as ex:
             raise ex
@@ -63,44 +68,120 @@ class Model:
             raise Exception(str(ex)) from ex
 
     @classmethod
-    def create(cls, engine=None, **kwargs):
+    def get_objects_page(cls, with_total=False, **kwargs):
         """
-        Create a new object and store it in the database.
+        Retrieve a page of data from the table using the Dynamic Filter.
 
-        This method creates a new object based on the provided keyword arguments and saves it to the database.
+        The statement built by the Dynamic Filter is executed through SQLAlchemy Core and
+        the rows are returned as mappings, no ORM object is constructed. With the `cursor`
+        parameter the page is read with keyset pagination, seeking past the last row of
+        the previous page instead of skipping `offset` rows. With `with_total` the number
+        of rows matching the filters is read in the same query.
 
         Parameters:
-            engine (optional): An engine for connecting to the database.
-            **kwargs: Additional keyword arguments representing the attributes of the object.
+            with_total: Count the rows matching the filters along with the page.
+            kwargs: Additional keyword arguments to filter the query (e.g., filters, sorting, cursor, fields).
 
         Returns:
-            The newly created object.
+            Tuple: A list of row mappings retrieved from the table and the page information:
+            {"total", "page", "limit", "next"}, where "next" is the cursor of the next page
+            (None on the last page) and "total" is None unless `with_total`.
         """
+
         try:
-            instance = cls(**kwargs)
+            engine = DbConfig().get_engine()
 
-            if engine is None:
-                engine = create_engine(
-                    DbConfig().database_connection_url,
-                    pool_size=100,
-                    max_overflow=0,
-                    connect_args={"connect_timeout": 60},
+            with sessionmaker(
+                bind=engine, expire_on_commit=True, autoflush=False
+            )() as database_session:
+                query_result = DynamicFilter(
+                    cls, session=database_session, query=kwargs
                 )
+                connection = database_session.connection()
+                total = None
+                if with_total:
+                    #   Underscore prefixed columns are not serialized
+                    statement, parameters = query_result.cached_statement("total")
+                    result = connection.execute(statement, parameters).mappings().all()
+                    #   An empty page has no row to read the total from
+                    total = result[0]["_total"] if result else query_result.count()
+                else:
+                    statement, parameters = query_result.cached_statement()
+                    result = connection.execute(statement, parameters).mappings().all()
+                page_info = query_result.page_info(result, total)
+
+            return result, page_info
+        except OperationalError as ex:
+            raise ex
+        except Exception as ex:
+            logging.error(f"Exception from {cls.get_objects_page.__name__} :  {ex}")
+            if len(ex.args) >= 2 and isinstance(ex.args[1], dict):
+                raise
+            raise Exception(str(ex)) from ex
+
+    @classmethod
+    def stream_objects(cls, chunk_size: int = STREAM_CHUNK_SIZE, **kwargs):
+        """
+        Retrieve data from the table using the Dynamic Filter, chunk by chunk.
+
+        The rows are fetched through a server side cursor, at most `chunk_size` rows at a
+        time, and returned as mappings like `get_objects_page`, so memory use does not
+        depend on the size of the result. The connection is held until the generator is
+        exhausted or closed.
+
+        Parameters:
+            chunk_size: Number of rows fetched per round trip.
+            kwargs: Additional keyword arguments to filter the query (e.g., filters, sorting).
+
+        Returns:
+            Generator: Lists of at most `chunk_size` row mappings retrieved from the table.
+        """
+
+        try:
+            engine = DbConfig().get_engine()
 
             with sessionmaker(
                 bind=engine, expire_on_commit=True, autoflush=False
             )() as database_session:
-                database_session.add(instance)
-                database_session.commit()
-                instance = database_session.query(cls).filter_by(**kwargs).one_or_none()
+                query_result = DynamicFilter(
+                    cls, session=database_session, query=kwargs
+                )
+                statement, parameters = query_result.cached_statement()
+                result = database_session.connection().execute(
+                    statement,
+                    parameters,
+                    execution_options={"yield_per": chunk_size},
+                )
+                yield from result.mappings().partitions()
+        except OperationalError as ex:
+            raise ex
+        except Exception as ex:
+            logging.error(f"Exception from {cls.stream_objects.__name__} :  {ex}")
+            raise Exception(str(ex)) from ex
 
-            engine.dispose()
-            return instance
+    @classmethod
+    def create(cls, engine=None, **kwargs):
+        """
+        Create a new object and store it in the database.
 
-        except MultipleResultsFound:
-            instance = cls.db_session.query(cls).filter_by(**kwargs)[0]
-            cls.db_session.close()
-            return instance
+        The row is inserted with a single `INSERT ... RETURNING` statement, so the stored row,
+        with its generated id and server defaults, is returned without querying it again.
+
+        Parameters:
+            engine (optional): An engine for connecting to the database.
+            **kwargs: Additional keyword arguments representing the attributes of the object.
+
+        Returns:
+            The newly created row as a dictionary.
+        """
+        try:
+            if engine is None:
+                engine = DbConfig().get_engine()
+
+            with engine.begin() as connection:
+                row = cls.insert_row(connection, kwargs)
+
+            return row
 
         except OperationalError as ex:
             raise Exception(f"Database not found for the provided database name")
@@ -120,19 +201,14 @@ class Model:
             **kwargs: Keyword arguments representing the attributes used to query the object.
 
         Returns:
-            Tuple: object instance
+            Tuple: object instance (the created row as a dictionary) and whether it already existed
         """
         try:
             kwarg_string = {
                 key: kwargs[key] for key, value in kwargs.items() if value is not None
             }
 
-            engine = create_engine(
-                DbConfig().database_connection_url,
-                pool_size=100,
-                max_overflow=0,
-                connect_args={"connect_timeout": 60},
-            )
+            engine = DbConfig().get_engine()
 
             with sessionmaker(
                 bind=engine, expire_on_commit=True, autoflush=False
@@ -147,11 +223,9 @@ class Model:
                     instance = database_session.query(cls).filter_by(**kwarg_string)[0]
 
             if instance:
-                engine.dispose()
                 return instance, True
 
-            instance = cls.create(**kwarg_string)
-            engine.dispose()
+            instance = cls.create(engine=engine, **kwarg_string)
             return instance, False
 
         except OperationalError as ex:
@@ -163,61 +237,48 @@ class Model:
     @classmethod
     def get_or_create_bulk(cls, data_list):
         """
-        Retrieve existing objects from the database or create new ones if not found.
+        Create new objects from a list of dictionaries with set based inserts.
 
-        This method retrieves objects from the database based on the provided list of dictionaries.
-        If an object is found, it is returned. If not found, a new object is created using the dictionary's attributes
-        and saved to the database.
+        The rows are inserted in chunks of `BULK_CREATE_CHUNK_SIZE` with multi-row
+        `INSERT ... ON CONFLICT DO NOTHING RETURNING` statements, one transaction per chunk.
+        If a chunk fails, it is inserted again row by row inside savepoints, so only the
+        failing rows are reported. Rows skipped because of a unique conflict are not returned.
 
         Parameters:
-            data_list (list of dictionaries): List of dictionaries where each dictionary represents attributes used to query
-            the object.
+            data_list (list of dictionaries): List of dictionaries where each dictionary represents the attributes
+            of a new object.
 
         Returns:
-            List of tuples: [(object instance, created), ...]
+            Tuple: (list of created rows as dictionaries, list of failed rows with their error)
         """
         try:
-            engine = create_engine(
-                DbConfig().database_connection_url,
-                pool_size=100,
-                max_overflow=0,
-                connect_args={"connect_timeout": 120},
-            )
+            engine = DbConfig().get_engine()
 
             instances = []
-            created_flags = []
             failed_instance = []
 
-            with sessionmaker(
-                bind=engine, expire_on_commit=True, autoflush=False
-            )() as database_session:
-                for data in data_list:
-                    kwarg_string = {
-                        key: value for key, value in data.items() if value is not None
-                    }
-                    try:
-                        instance = (
-                            database_session.query(cls)
-                            .filter_by(**kwarg_string)
-                            .one_or_none()
-                        )
-                        if instance:
-                            instances.append(instance)
-                            created_flags.append(True)
-                        else:
-                            new_instance = cls.create(engine=engine, **kwarg_string)
-                            instances.append(new_instance)
-                            created_flags.append(False)
-
-                    except Exception as ex:
-                        logging.error(f"Error while processing data: {ex}")
-                        failed_instance.append(
-                            {"Error": ex.args[0], "data": kwarg_string}
-                        )
-                        continue
+            with engine.connect() as connection:
+                for start in range(0, len(data_list), BULK_CREATE_CHUNK_SIZE):
+                    chunk = [
+                        {key: value for key, value in data.items() if value is not None}
+                        for data in data_list[start : start + BULK_CREATE_CHUNK_SIZE]
+                    ]
+                    with connection.begin():
+                        try:
+                            with connection.begin_nested():
+                                instances.extend(cls.insert_rows(connection, chunk))
+                            continue
+                        except Exception as ex:
+                            logging.error(f"Error while processing chunk: {ex}")
+
+                        for data in chunk:
+                            try:
+                                with connection.begin_nested():
+                                    instances.extend(cls.insert_rows(connection, [data]))
+                            except Exception as ex:
+                                logging.error(f"Error while processing data: {ex}")
+                                failed_instance.append({"Error": ex.args[0], "data": data})
 
-            engine.dispose()
-            # return list(zip(instances, created_flags))
             return instances, failed_instance
 
         except OperationalError as ex:
@@ -226,6 +287,173 @@ class Model:
             logging.error(f"Exception from {cls.get_or_create_bulk.__name__}: {ex}")
             raise ex
 
+    @classmethod
+    def bulk_update(cls, data, max_rows, **kwargs):
+        """
+        Update the rows matching the Dynamic Filter with a single `UPDATE ... WHERE ...
+        RETURNING id` statement.
+
+        Parameters:
+            data: Dictionary of the column values to set.
+            max_rows: Maximum number of rows updated (required), the update is rolled back above it.
+            kwargs: The filter query parameters selecting the rows.
+
+        Returns:
+            List: The ids of the updated rows.
+        """
+        data = {key: value for key, value in data.items() if value is not None}
+        if not data:
+            raise Exception("Data payload is empty", {"status_code": 400})
+        return cls.write_filtered("update", max_rows, cls.coerce_row(data), **kwargs)
+
+    @classmethod
+    def bulk_delete(cls, max_rows, **kwargs):
+        """
+        Delete the rows matching the Dynamic Filter with a single `DELETE ... WHERE ...
+        RETURNING id` statement.
+
+        Parameters:
+            max_rows: Maximum number of rows deleted (required), the delete is rolled back above it.
+            kwargs: The filter query parameters selecting the rows.
+
+        Returns:
+            List: The ids of the deleted rows.
+        """
+        return cls.write_filtered("delete", max_rows, None, **kwargs)
+
+    @classmethod
+    def write_filtered(cls, kind, max_rows, values, **kwargs):
+        """
+        Execute the cached "update" or "delete" statement of the Dynamic Filter (see
+        `DynamicFilter.cached_statement`) in one transaction, rolled back if it affects more
+        than `max_rows` rows. A filter is required, and filters on unknown columns or with
+        unknown operators are rejected, so a table is never written as a whole.
+        """
+        invalid = [key for key in kwargs if key in BULK_WRITE_INVALID_PARAMETERS]
+        if invalid:
+            raise Exception(
+                f"Unsupported parameter(s) for a bulk {kind}: {', '.join(invalid)}",
+                {"status_code": 400},
+            )
+        if not kwargs:
+            raise Exception(f"A filter is required for a bulk {kind}", {"status_code": 400})
+        try:
+            max_rows = int(max_rows)
+        except (TypeError, ValueError):
+            max_rows = 0
+        if max_rows < 1:
+            raise Exception(
+                f"A positive max_rows parameter is required for a bulk {kind}",
+                {"status_code": 400},
+            )
+
+        try:
+            engine = DbConfig().get_engine()
+
+            with engine.connect() as connection:
+                with connection.begin():
+                    with sessionmaker(bind=connection, autoflush=False)() as database_session:
+                        query_result = DynamicFilter(
+                            cls, session=database_session, query=kwargs
+                        )
+                        query_result.validate_filters()
+                        statement, parameters = query_result.cached_statement(kind)
+                    if values is not None:
+                        statement = statement.values(**values)
+                    ids = connection.execute(statement, parameters).scalars().all()
+                    if len(ids) > max_rows:
+                        raise Exception(
+                            f"The filters match {len(ids)} rows, more than max_rows={max_rows}: nothing was written",
+                            {"status_code": 400},
+                        )
+
+            return ids
+        except OperationalError as ex:
+            raise Exception(f"Database not found for the provided database name")
+        except Exception as ex:
+            logging.error(f"Exception from {cls.write_filtered.__name__} :  {ex}")
+            raise ex
+
+    @classmethod
+    def insert_rows(cls, connection, rows):
+        """
+        Insert the rows with `INSERT ... ON CONFLICT DO NOTHING RETURNING` and return the
+        inserted rows as dictionaries. Rows are grouped by their keys, so every group is
+        sent as a single multi-row insert.
+        """
+        table = cls.__table__
+        statement = insert(table).on_conflict_do_nothing().returning(*table.columns)
+
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(cls.coerce_row(row))
+
+        inserted = []
+        for group in groups.values():
+            result = connection.execute(statement, group)
+            inserted.extend(dict(row) for row in result.mappings())
+        return inserted
+
+    @classmethod
+    def coerce_row(cls, row):
+        """Return the values of the row coerced to the column types, rejecting unknown columns"""
+        columns = cls.__table__.columns
+        unknown_keys = set(row) - set(columns.keys())
+        if unknown_keys:
+            raise Exception(f"Unknown columns: {', '.join(sorted(unknown_keys))}")
+        return {key: coerce_value(columns[key], value) for key, value in row.items()}
+
+    @classmethod
+    def select_rows(cls, connection, **kwargs):
+        """
+        Retrieve the rows matching the Dynamic Filter query on an open connection, so they
+        are read inside the transaction of the connection, as mappings.
+        """
+        with sessionmaker(bind=connection, autoflush=False)() as database_session:
+            query_result = DynamicFilter(cls, session=database_session, query=kwargs)
+            statement, parameters = query_result.cached_statement()
+        return connection.execute(statement, parameters).mappings().all()
+
+    @classmethod
+    def insert_row(cls, connection, row):
+        """
+        Insert the row with `INSERT ... RETURNING` on an open connection and return the
+        stored row, with its generated id and server defaults, as a dictionary.
+        """
+        table = cls.__table__
+        statement = insert(table).values(**cls.coerce_row(row)).returning(*table.columns)
+        return dict(connection.execute(statement).mappings().one())
+
+    @classmethod
+    def update_row(cls, connection, id, row):
+        """
+        Update the row of the id with `UPDATE ... RETURNING` on an open connection and
+        return the updated row as a dictionary, None if there is no row with the id.
+        """
+        table = cls.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == coerce_value(table.c.id, id))
+            .values(**cls.coerce_row(row))
+            .returning(*table.columns)
+        )
+        result = connection.execute(statement).mappings().one_or_none()
+        return dict(result) if result is not None else None
+
+    @classmethod
+    def delete_row(cls, connection, id):
+        """
+        Delete the row of the id with `DELETE ... RETURNING` on an open connection and
+        return the deleted id, None if there is no row with the id.
+        """
+        table = cls.__table__
+        statement = (
+            delete(table)
+            .where(table.c.id == coerce_value(table.c.id, id))
+            .returning(table.c.id)
+        )
+        return connection.execute(statement).scalar_one_or_none()
+
     @classmethod
     def get_single_object(cls, **kwargs):
         """
@@ -244,15 +472,12 @@ class Model:
 
         try:
             filter_string = {
-                key: kwargs[key] for key, value in kwargs.items() if value is not None
+                key: coerce_value(getattr(cls, key, None), value)
+                for key, value in kwargs.items()
+                if value is not None
             }
 
-            engine = create_engine(
-                DbConfig().database_connection_url,
-                pool_size=100,
-                max_overflow=0,
-                connect_args={"connect_timeout": 60},
-            )
+            engine = DbConfig().get_engine()
 
             with sessionmaker(
                 bind=engine, expire_on_commit=True, autoflush=False
@@ -262,7 +487,6 @@ class Model:
                 )
                 session = database_session
 
-            engine.dispose()
             return instance, session
 
         except MultipleResultsFound:
@@ -277,11 +501,12 @@ class Model:
             raise Exception(str(ex)) from ex
 
     @classmethod
-    def get_count(cls, **kwargs):
+    def get_count(cls, estimate=False, **kwargs):
         """
         Retrieve number of rows count from the table using the Dynamic Filter.
 
         Parameters:
+            estimate: Return the planner estimate instead of counting the rows.
             kwargs: Additional keyword arguments to filter the query (e.g., filters, sorting).
 
         Returns:
@@ -289,12 +514,7 @@ class Model:
         """
 
         try:
-            engine = create_engine(
-                DbConfig().database_connection_url,
-                pool_size=100,
-                max_overflow=0,
-                connect_args={"connect_timeout": 60},
-            )
+            engine = DbConfig().get_engine()
 
             with sessionmaker(
                 bind=engine, expire_on_commit=True, autoflush=False
@@ -302,10 +522,8 @@ class Model:
                 query_result = DynamicFilter(
                     cls, session=database_session, query=kwargs
                 )
-                result, count, page = query_result.search()
-                # result = page.all()
+                count = query_result.count(estimate=estimate)
 
-            engine.dispose()
             return count
 
         except OperationalError as ex:
@@ -314,48 +532,59 @@ class Model:
             logging.error(f"Exception from {cls.get_count.__name__} :  {ex}")
             raise Exception(str(ex)) from ex
 
-    def update(self, session, **kwargs):
+    @classmethod
+    def update_by_id(cls, id, **kwargs):
         """
-        Update the attributes of the object in the database.
-
-        This method updates the attributes of the object with the provided keyword arguments and saves the changes to
-        the database using the provided session.
+        Update the row of the id with a single `UPDATE ... WHERE id = :id RETURNING *`
+        statement, committed on return.
 
         Parameters:
-            session: The sqlalchemy session used for the update operation.
-            **kwargs: Keyword arguments representing the attributes to be updated.
+            id: The id of the row to update.
+            **kwargs: Keyword arguments representing the attributes to be updated, None values are ignored.
+
+        Returns:
+            The updated row as a dictionary, None if no row has the id.
         """
         try:
-            for key in kwargs:
-                if kwargs[key] is not None and hasattr(self, key):
-                    setattr(self, key, kwargs[key])
-            session.add(self)
-            session.commit()
-
-            return self.__class__.get_single_object(id=self.id)
-        except MultipleResultsFound as ex:
-            logging.error(f"Exception from {self.update.__name__}: {ex}")
-            session.rollback()
-            raise ex
-        finally:
-            session.close()
+            values = {key: value for key, value in kwargs.items() if value is not None}
+            if not values:
+                raise Exception("Data payload is empty", {"status_code": 400})
+
+            engine = DbConfig().get_engine()
 
-    def delete(self, session):
-        """Delete the object from the database.
+            with engine.begin() as connection:
+                row = cls.update_row(connection, id, values)
 
-        This method deletes the object from the database using the provided session.
+            return row
+        except OperationalError as ex:
+            raise Exception(f"Database not found for the provided database name")
+        except Exception as ex:
+            logging.error(f"Exception from {cls.update_by_id.__name__}: {ex}")
+            raise ex
+
+    @classmethod
+    def delete_by_id(cls, id):
+        """
+        Delete the row of the id with a single `DELETE ... WHERE id = :id RETURNING id`
+        statement, committed on return.
 
         Parameters:
-            session: The sqlalchemy session used for the deletion.
+            id: The id of the row to delete.
+
+        Returns:
+            The deleted id, None if no row has the id.
         """
         try:
-            session.delete(self)
-            session.commit()
-            session.close()
+            engine = DbConfig().get_engine()
+
+            with engine.begin() as connection:
+                deleted_id = cls.delete_row(connection, id)
+
+            return deleted_id
         except OperationalError as ex:
             raise Exception(f"Database not found for the provided database name")
-        except MultipleResultsFound as ex:
-            logging.error(f"Exception from {self.delete.__name__} : {ex}")
+        except Exception as ex:
+            logging.error(f"Exception from {cls.delete_by_id.__name__} : {ex}")
             raise ex
 
 
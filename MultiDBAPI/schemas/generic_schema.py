@@ -1,5 +1,6 @@
 from pydantic.main import create_model
-from config.db import DbConfig
+from config.request_context import RequestContext
+from services.reflection_cache import ReflectionCache
 
 
 class Config:
@@ -27,29 +28,37 @@ class CustomDerivedSchemaFactory:
         return cls.__instance
 
     @classmethod
-    def get_custom_derived_model(cls, class_name: str):
+    def get_custom_derived_model(cls, class_name: str = None):
         """
         Returns a Custom Base Schema:
 
-        If the class name is not found in the `custom_schema_dict` dictionary,
-        it generates a custom derived schema and add it to the `custom_schema_dict`.
+        If the (engine key, class name) is not found in the `custom_schema_dict` dictionary, or the
+        table has been reflected again since the schema was generated, it generates a custom
+        derived schema and add it to the `custom_schema_dict`.
         Finally, it returns schema from the `custom_schema_dict`.
+        The class name defaults to the table of the `RequestContext`.
         """
 
+        if class_name is None:
+            class_name = RequestContext.current().table_name.capitalize()
         class_name = "_".join(class_name.split("-"))
+        reflection = ReflectionCache().get(class_name.lower())
+        key = (reflection["engine_key"], class_name)
 
-        if not cls.custom_schema_dict.get(class_name):
-            cls.custom_schema_dict.update(
-                {class_name: cls.custom_derived_model(class_name.lower())}
-            )
-        return cls.custom_schema_dict.get(class_name)
+        generation, schema = cls.custom_schema_dict.get(key, (None, None))
+        if generation != reflection["generation"]:
+            schema = cls.custom_derived_model(class_name.lower(), reflection["columns"])
+            cls.custom_schema_dict.update({key: (reflection["generation"], schema)})
+        return schema
 
     @classmethod
-    def custom_derived_model(cls, model_name: str):
+    def custom_derived_model(cls, model_name: str, columns: list = None):
         """
         Generate and Return Custom Model
         """
-        table_info = cls.get_table_info(model_name)
+        if columns is None:
+            columns = ReflectionCache().get_columns(model_name)
+        table_info = cls.get_schema_fields_dict(columns)
         model = create_model("model_name", **table_info)
         model.Config = Config
         return model
@@ -60,7 +69,7 @@ class CustomDerivedSchemaFactory:
         Get and Return Table Information from Database after processing
         """
         try:
-            columns = DbConfig().get_db_columns(tablename)
+            columns = ReflectionCache().get_columns(tablename)
             schema_fields = cls.get_schema_fields_dict(columns)
             return schema_fields
         except Exception:
@@ -78,13 +87,19 @@ class CustomDerivedSchemaFactory:
         }
 
     @classmethod
-    def get_schema(cls, table_name):
-        """Get Table Schema from Database"""
-        if not cls.schema.get(table_name):
-            schema = cls.get_table_info(table_name)
+    def get_schema(cls, table_name: str = None):
+        """Get Table Schema from Database, of the table of the `RequestContext` by default"""
+        if table_name is None:
+            table_name = RequestContext.current().table_name.lower()
+        reflection = ReflectionCache().get(table_name)
+        key = (reflection["engine_key"], table_name)
+
+        generation, schema = cls.schema.get(key, (None, None))
+        if generation != reflection["generation"]:
+            schema = cls.get_schema_fields_dict(reflection["columns"])
             cls.convert_values_to_type(schema, str)
-            cls.schema.update({table_name: schema})
-        return cls.schema.get(table_name)
+            cls.schema.update({key: (reflection["generation"], schema)})
+        return schema
 
     @staticmethod
     def convert_values_to_type(dictionary: dict, new_type: type):
@@ -0,0 +1,223 @@
+import base64
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+
+import orjson
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+
+def encode_bytes(value):
+    return base64.b64encode(value).decode("ascii")
+
+
+def encode_isoformat(value):
+    return value.isoformat()
+
+
+""" Converters of the column python types a format does not serialize natively """
+CONVERTERS = {
+    JSON: {
+        Decimal: float,
+        bytes: encode_bytes,
+    },
+    MSGPACK: {
+        Decimal: float,
+        date: encode_isoformat,
+        datetime: encode_isoformat,
+        time: encode_isoformat,
+        UUID: str,
+    },
+}
+
+""" Arrow types of the column python types, the others are inferred from the values """
+ARROW_TYPES = {
+    int: "int64",
+    float: "float64",
+    bool: "bool_",
+    str: "string",
+    bytes: "binary",
+}
+
+
+class RowEncoder:
+    """
+    Per-table encoder of row mappings (see `Model.get_objects_page`).
+
+    The converter of every column is looked up once from the reflected column types, so a
+    row is encoded without any per-cell type dispatch: for JSON, date, datetime, time, UUID
+    and JSON columns are written natively by orjson and only Decimal and bytes columns are
+    converted. Rows are also encoded as MessagePack, or column-wise as an Arrow IPC stream.
+    The encoder is stored in the `info` of the table, so it is generated again along with
+    the model after a change of the table definition.
+    """
+
+    def __init__(self, table):
+        self.python_types = {}
+        for column in table.columns:
+            try:
+                self.python_types[column.key] = column.type.python_type
+            except NotImplementedError:
+                self.python_types[column.key] = None
+        self.converters = {
+            media_type: {
+                name: converters[python_type]
+                for name, python_type in self.python_types.items()
+                if python_type in converters
+            }
+            for media_type, converters in CONVERTERS.items()
+        }
+
+    @classmethod
+    def for_table(cls, table):
+        """Return the encoder of the table, generating it on first use"""
+        encoder = table.info.get("row_encoder")
+        if encoder is None:
+            encoder = table.info["row_encoder"] = cls(table)
+        return encoder
+
+    @staticmethod
+    def is_supported(media_type: str) -> bool:
+        """Whether the library encoding the media type is installed"""
+        return {MSGPACK: msgpack, ARROW: pyarrow}.get(media_type, True) is not None
+
+    @staticmethod
+    def column_names(rows: list, fields: list = None) -> list:
+        """Names of the encoded columns, underscore prefixed ones (e.g. the window total) are left out"""
+        if not rows:
+            return list(fields or [])
+        return [name for name in fields or rows[0].keys() if not name.startswith("_")]
+
+    def rows(self, rows: list, fields: list = None, media_type: str = JSON) -> list:
+        """
+        Return the rows as dictionaries of values serializable in the media type (JSON or
+        MessagePack), restricted to `fields` if given.
+        """
+        names = self.column_names(rows, fields)
+        converters = [
+            (name, self.converters[media_type][name])
+            for name in names
+            if name in self.converters[media_type]
+        ]
+
+        encoded = []
+        for row in rows:
+            row = {name: row[name] for name in names}
+            for name, converter in converters:
+                value = row[name]
+                if value is not None:
+                    row[name] = converter(value)
+            encoded.append(row)
+        return encoded
+
+    def columns(self, rows: list, fields: list = None, media_type: str = JSON) -> dict:
+        """
+        Return the rows column-wise, `{"columns": [...], "data": {column: [values...]}}`, with
+        the values serializable in the media type (JSON or MessagePack).
+        """
+        names = self.column_names(rows, fields)
+        data = {}
+        for name in names:
+            values = [row[name] for row in rows]
+            converter = self.converters[media_type].get(name)
+            if converter is not None:
+                values = [None if value is None else converter(value) for value in values]
+            data[name] = values
+        return {"columns": names, "data": data}
+
+    def encode(
+        self,
+        rows: list,
+        fields: list = None,
+        media_type: str = JSON,
+        page_info: dict = None,
+        shape: str = "rows",
+    ) -> bytes:
+        """
+        Return the rows encoded in the media type, as a list of rows or with `shape="columns"`
+        column-wise (see `columns`). With `page_info` the rows are wrapped in a
+        `{items, **page_info}` envelope, or for Arrow stored in the schema metadata.
+        """
+        if media_type == ARROW:
+            return self.dumps_arrow(rows, fields, page_info)
+        if shape == "columns":
+            data = self.columns(rows, fields, media_type)
+        else:
+            data = self.rows(rows, fields, media_type)
+        if page_info is not None:
+            data = {"items": data, **page_info}
+        if media_type == MSGPACK:
+            return msgpack.packb(data, default=msgpack_default)
+        return orjson.dumps(data, default=json_default)
+
+    def dumps(self, rows: list, fields: list = None) -> bytes:
+        """Return the rows encoded as a JSON array"""
+        return self.encode(rows, fields)
+
+    def dumps_ndjson(self, rows: list, fields: list = None) -> bytes:
+        """Return the rows encoded as newline delimited JSON"""
+        return b"".join(
+            orjson.dumps(row, default=json_default, option=orjson.OPT_APPEND_NEWLINE)
+            for row in self.rows(rows, fields)
+        )
+
+    def dumps_arrow(self, rows: list, fields: list = None, page_info: dict = None) -> bytes:
+        """Return the rows as an Arrow IPC stream, built column by column"""
+        arrays = {
+            name: self.arrow_array(name, [row[name] for row in rows])
+            for name in self.column_names(rows, fields)
+        }
+        metadata = None
+        if page_info is not None:
+            metadata = {key: orjson.dumps(value) for key, value in page_info.items()}
+        table = pyarrow.table(arrays, metadata=metadata)
+
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    def arrow_array(self, name: str, values: list):
+        python_type = self.python_types.get(name)
+        if python_type in ARROW_TYPES:
+            return pyarrow.array(values, type=getattr(pyarrow, ARROW_TYPES[python_type])())
+        if python_type in [dict, list]:
+            values = [None if value is None else orjson.dumps(value).decode() for value in values]
+            return pyarrow.array(values, type=pyarrow.string())
+        if python_type is UUID:
+            values = [None if value is None else str(value) for value in values]
+            return pyarrow.array(values, type=pyarrow.string())
+        try:
+            return pyarrow.array(values)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            values = [None if value is None else str(value) for value in values]
+            return pyarrow.array(values, type=pyarrow.string())
+
+
+def json_default(value):
+    """Serialize the values orjson does not support natively"""
+    converter = CONVERTERS[JSON].get(type(value))
+    if converter is not None:
+        return converter(value)
+    return str(value)
+
+
+def msgpack_default(value):
+    """Serialize the values msgpack does not support natively"""
+    converter = CONVERTERS[MSGPACK].get(type(value))
+    if converter is not None:
+        return converter(value)
+    return str(value)
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from collections.abc import Mapping
 from datetime import date, datetime
 from decimal import Decimal
 
@@ -10,9 +11,10 @@ class Serialiazer(ABC):
 
 
 class GenericSerializer(Serialiazer):
-    def __init__(self, object, many=False):
+    def __init__(self, object, many=False, fields=None):
         self.object = object
         self.many = many
+        self.fields = fields
 
     def run_serializer(self):
         try:
@@ -30,9 +32,14 @@ class GenericSerializer(Serialiazer):
         try:
             cols = self.get_columns(obj)
             obj_dict = {}
+            if self.fields:
+                cols = [field for field in self.fields if field in cols]
             for field in cols:
                 if not field.startswith("_"):
-                    data = getattr(obj, field, None)
+                    if isinstance(obj, Mapping):
+                        data = obj.get(field)
+                    else:
+                        data = getattr(obj, field, None)
                     data = self.convert_data(data)
                     obj_dict[field] = data
             return obj_dict
@@ -52,6 +59,8 @@ class GenericSerializer(Serialiazer):
 
     def get_columns(self, obj):
         try:
+            if isinstance(obj, Mapping):
+                return obj
             return vars(obj)
         except Exception as ex:
             raise Exception(f"Error encountered from get_columns: {str(ex)}")
@@ -0,0 +1,184 @@
+"""
+    Batch
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import logging
+from collections import namedtuple
+
+from sqlalchemy.exc import OperationalError
+
+from config.db import DbConfig
+from config.request_context import RequestContext
+from config.settings import BATCH_MAX_OPERATIONS
+from models import CustomDerivedModelFactory
+from schemas import CustomDerivedSchemaFactory
+from serializers.row_encoder import RowEncoder
+
+""" Response status of the successful operations, as returned by their own endpoints """
+OPERATION_STATUS = {"get": 200, "create": 201, "update": 202, "delete": 202}
+
+""" Operation of a batch, with the model of its table and its validated data """
+Operation = namedtuple("Operation", ["index", "op", "table", "model", "id", "data", "query"])
+
+
+def prepare_operations(operations: list) -> list:
+    """
+    Validate the operations of a batch and resolve the model of their tables before any
+    statement is executed: the data of the create and update operations is validated by
+    the schema of the table. The table of an operation defaults to the `table_name` of
+    the `database_info`.
+
+    Raises a 400 error naming the first invalid operation.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise Exception("Operations payload is empty", {"status_code": 400})
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise Exception(
+            f"A batch is limited to {BATCH_MAX_OPERATIONS} operations", {"status_code": 400}
+        )
+
+    prepared = []
+    for index, operation in enumerate(operations):
+        try:
+            if not isinstance(operation, dict):
+                raise Exception("An operation must be an object")
+            op = operation.get("op")
+            if op not in OPERATION_STATUS:
+                raise Exception(f"Unsupported operation: {op}")
+            table = operation.get("table") or RequestContext.current().table_name
+            if not table:
+                raise Exception("Missing table")
+            if op in ["update", "delete"] and operation.get("id") is None:
+                raise Exception("Missing id")
+
+            data = None
+            if op in ["create", "update"]:
+                if not operation.get("data"):
+                    raise Exception("Data payload is empty")
+                DerivedSchema = CustomDerivedSchemaFactory.get_custom_derived_model(
+                    table.capitalize()
+                )
+                data = {
+                    key: value
+                    for key, value in DerivedSchema(**operation["data"]).dict().items()
+                    if value is not None
+                }
+                if not data:
+                    raise Exception("Data payload is empty")
+
+            #   The query parameters of a get, as parsed from a query string
+            query = {
+                key: [str(item) for item in value] if isinstance(value, list) else [str(value)]
+                for key, value in (operation.get("query") or {}).items()
+            }
+            model = CustomDerivedModelFactory.get_custom_derived_model(table.capitalize())
+        except OperationalError:
+            raise
+        except Exception as ex:
+            raise Exception(
+                f"Invalid operation {index}: {ex.args[0] if ex.args else ex}",
+                {"status_code": 400},
+            ) from ex
+        prepared.append(
+            Operation(index, op, table, model, operation.get("id"), data, query)
+        )
+    return prepared
+
+
+def execute_operation(connection, operation: Operation):
+    """
+    Execute the operation on the connection and return its data, the rows encoded like
+    the `/get` rows by the encoder of the table.
+    """
+    model = operation.model
+    encoder = RowEncoder.for_table(model.__table__)
+    if operation.op == "get":
+        return encoder.rows(model.select_rows(connection, **operation.query))
+    if operation.op == "create":
+        return encoder.rows([model.insert_row(connection, operation.data)])[0]
+    if operation.op == "update":
+        row = model.update_row(connection, operation.id, operation.data)
+        row = encoder.rows([row])[0] if row is not None else None
+    else:
+        row = model.delete_row(connection, operation.id)
+        row = {"id": row} if row is not None else None
+    if row is None:
+        raise Exception("No matching data found for the specified id.", {"status_code": 400})
+    return row
+
+
+def operation_error(ex: Exception):
+    """Return the message and the status code of the error of an operation"""
+    if len(ex.args) >= 2 and isinstance(ex.args[1], dict):
+        return ex.args[0], ex.args[1].get("status_code", 400)
+    return str(ex), 400
+
+
+def run_batch(operations: list, savepoints: bool = False) -> list:
+    """
+    Execute an ordered list of get / create / update / delete operations against the
+    tables of the current database, on one connection and in one transaction.
+
+    Without `savepoints` the first failing operation rolls back the whole batch and an
+    error naming the operation is raised. With `savepoints` every operation runs in its
+    own savepoint: a failing operation is rolled back alone and reported in its result,
+    the others are committed.
+
+    Parameters:
+        operations: List of {"op", "table" (optional), "id", "data", "query"} dictionaries.
+        savepoints: Run every operation in a savepoint.
+
+    Returns:
+        List: One {"index", "op", "table", "status", "data"} result per operation, in order,
+        or {"index", "op", "table", "status", "Error"} for a failed operation.
+    """
+    try:
+        prepared = prepare_operations(operations)
+        engine = DbConfig().get_engine()
+
+        results = []
+        with engine.connect() as connection:
+            with connection.begin():
+                for operation in prepared:
+                    result = {
+                        "index": operation.index,
+                        "op": operation.op,
+                        "table": operation.table,
+                    }
+                    if not savepoints:
+                        try:
+                            data = execute_operation(connection, operation)
+                        except OperationalError:
+                            raise
+                        except Exception as ex:
+                            message, code = operation_error(ex)
+                            raise Exception(
+                                f"Operation {operation.index} ({operation.op} {operation.table}) failed, the batch was rolled back: {message}",
+                                {"status_code": code},
+                            ) from ex
+                        results.append(
+                            {**result, "status": OPERATION_STATUS[operation.op], "data": data}
+                        )
+                        continue
+
+                    try:
+                        with connection.begin_nested():
+                            data = execute_operation(connection, operation)
+                        results.append(
+                            {**result, "status": OPERATION_STATUS[operation.op], "data": data}
+                        )
+                    except OperationalError:
+                        raise
+                    except Exception as ex:
+                        logging.error(f"Error while processing operation: {ex}")
+                        message, code = operation_error(ex)
+                        results.append({**result, "status": code, "Error": message})
+
+        return results
+
+    except OperationalError as ex:
+        raise Exception(f"Database not found for the provided database name")
+    except Exception as ex:
+        logging.error(f"Exception from {run_batch.__name__} :  {ex}")
+        raise ex
@@ -0,0 +1,324 @@
+"""
+    CopyLoader
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import codecs
+import csv
+import json
+
+from sqlalchemy.util import await_only
+
+from config.db import DbConfig
+from config.settings import (
+    COPY_MAX_RECORD_SIZE,
+    COPY_QUEUE_SIZE,
+    COPY_REJECTED_SAMPLES,
+    DB_ASYNC_MODE,
+)
+from services.executor import DatabaseExecutor
+
+COPY_FORMATS = ["csv", "ndjson"]
+# Characters of a rejected row reported back
+REJECTED_DATA_SIZE = 1000
+
+
+class CopyTransformer:
+    """
+    Converts the chunks of a CSV or NDJSON request body into the CSV rows fed to `COPY`.
+
+    Chunks are converted as they arrive, only the trailing partial line (or the lines of a
+    CSV record with a quoted line break) is kept between two chunks. The first CSV record,
+    or the keys of the first NDJSON object, name the loaded columns and are validated
+    against the reflected table. Rows which do not match the header are left out of the
+    COPY and counted as rejected.
+
+    A record (or a line) is buffered up to `COPY_MAX_RECORD_SIZE` characters: a longer one,
+    e.g. the rest of the payload after an unbalanced quote, is rejected and dropped, so a
+    malformed row never holds the upload in memory.
+    """
+
+    def __init__(self, data_format: str, table_columns: list):
+        if data_format not in COPY_FORMATS:
+            raise Exception(
+                f"Unsupported format: {data_format}. Supported formats: {', '.join(COPY_FORMATS)}",
+                {"status_code": 415},
+            )
+        self.data_format = data_format
+        self.table_columns = [column["name"] for column in table_columns]
+        self.columns = None
+        self.rows_rejected = 0
+        self.rejected_rows = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._record = []
+        self._record_size = 0
+        self._record_quotes = 0
+        self._skipping = False
+        self._line = 0
+        self._record_line = 0
+
+    def feed(self, chunk: bytes, final: bool = False) -> bytes:
+        """Convert a chunk of the request body, `final` flushes the trailing partial line"""
+        lines = (self._buffer + self._decoder.decode(chunk, final)).split("\n")
+        self._buffer = "" if final else lines.pop()
+        if self._skipping:
+            #   Rest of a line rejected for its size
+            if lines:
+                lines.pop(0)
+                self._skipping = False
+            else:
+                self._buffer = ""
+        output = [self.convert_line(line.rstrip("\r")) for line in lines]
+        if len(self._buffer) > COPY_MAX_RECORD_SIZE:
+            self._line += 1
+            if not self._record:
+                self._record_line = self._line
+            self.reject_oversized("\n".join(self._record + [self._buffer]))
+            self.clear_record()
+            self._buffer = ""
+            self._skipping = True
+        if final and self._record:
+            self.reject("\n".join(self._record), "Unterminated quoted field")
+            self.clear_record()
+        return "".join(output).encode("utf-8")
+
+    def convert_line(self, line: str) -> str:
+        self._line += 1
+        if not self._record:
+            if not line.strip():
+                return ""
+            self._record_line = self._line
+        if self.data_format == "ndjson":
+            return self.convert_json(line)
+
+        #   A quoted field of the record continues on the next line
+        self._record.append(line)
+        self._record_size += len(line) + 1
+        self._record_quotes += line.count('"')
+        if self._record_size > COPY_MAX_RECORD_SIZE:
+            self.reject_oversized("\n".join(self._record))
+            self.clear_record()
+            return ""
+        if self._record_quotes % 2:
+            return ""
+        record = "\n".join(self._record)
+        self.clear_record()
+        return self.convert_csv(record)
+
+    def clear_record(self):
+        self._record = []
+        self._record_size = 0
+        self._record_quotes = 0
+
+    def convert_csv(self, record: str) -> str:
+        fields = next(csv.reader([record]))
+        if self.columns is None:
+            self.columns = self.validate_columns(fields)
+            return ""
+        if len(fields) != len(self.columns):
+            self.reject(record, f"Expected {len(self.columns)} fields, got {len(fields)}")
+            return ""
+        return record + "\n"
+
+    def convert_json(self, line: str) -> str:
+        try:
+            obj = json.loads(line)
+        except ValueError as ex:
+            self.reject(line, f"Invalid JSON: {ex}")
+            return ""
+        if not isinstance(obj, dict):
+            self.reject(line, "Expected a JSON object")
+            return ""
+        if self.columns is None:
+            self.columns = self.validate_columns(list(obj))
+        unexpected = [key for key in obj if key not in self.columns]
+        if unexpected:
+            self.reject(line, f"Unexpected field(s): {', '.join(unexpected)}")
+            return ""
+        return ",".join(self.format_field(obj.get(column)) for column in self.columns) + "\n"
+
+    def validate_columns(self, fields: list) -> list:
+        """Validate the header against the columns of the reflected table"""
+        columns = [field.strip() for field in fields]
+        unknown = [column for column in columns if column not in self.table_columns]
+        if unknown:
+            raise Exception(
+                f"Unknown column(s) for the table: {', '.join(unknown)}", {"status_code": 400}
+            )
+        if len(set(columns)) != len(columns):
+            raise Exception("Duplicate column(s) in the header", {"status_code": 400})
+        return columns
+
+    def reject(self, data: str, error: str):
+        self.rows_rejected += 1
+        if len(self.rejected_rows) < COPY_REJECTED_SAMPLES:
+            self.rejected_rows.append(
+                {"line": self._record_line, "Error": error, "data": data[:REJECTED_DATA_SIZE]}
+            )
+
+    def reject_oversized(self, data: str):
+        self.reject(
+            data,
+            f"Record longer than {COPY_MAX_RECORD_SIZE} characters (unterminated quoted field?)",
+        )
+
+    @staticmethod
+    def format_field(value) -> str:
+        """Format a JSON value as a CSV field, an unquoted empty field is loaded as NULL"""
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        else:
+            value = str(value)
+        return '"' + value.replace('"', '""') + '"'
+
+
+class QueueReader:
+    """
+    File-like object handing the chunks of an `asyncio.Queue` to `copy_expert` running on
+    a worker thread. An empty chunk ends the COPY, an exception aborts it.
+    """
+
+    def __init__(self, queue: asyncio.Queue, loop):
+        self.queue = queue
+        self.loop = loop
+        self.done = False
+
+    def read(self, size: int = -1) -> bytes:
+        if self.done:
+            return b""
+        chunk = asyncio.run_coroutine_threadsafe(self.queue.get(), self.loop).result()
+        if isinstance(chunk, Exception):
+            self.done = True
+            raise chunk
+        if not chunk:
+            self.done = True
+        return chunk
+
+
+async def copy_from_stream(
+    table_name: str, table_columns: list, data_format: str, stream
+) -> dict:
+    """
+    Load the CSV or NDJSON chunks of the async iterable returned by `stream()` into the
+    table with a single `COPY ... FROM STDIN`, without holding the payload in memory.
+
+    Returns: {"rows_loaded", "rows_rejected", "rejected_rows"}
+    """
+    transformer = CopyTransformer(data_format, table_columns)
+    chunks = stream().__aiter__()
+
+    #   Read until the header is known, COPY needs the column list
+    head = []
+    exhausted = False
+    while transformer.columns is None and not exhausted:
+        try:
+            head.append(transformer.feed(await chunks.__anext__()))
+        except StopAsyncIteration:
+            head.append(transformer.feed(b"", final=True))
+            exhausted = True
+    if transformer.columns is None:
+        raise Exception("Payload does not contain a header row", {"status_code": 400})
+
+    async def body():
+        for data in head:
+            if data:
+                yield data
+        if not exhausted:
+            async for chunk in chunks:
+                data = transformer.feed(chunk)
+                if data:
+                    yield data
+            data = transformer.feed(b"", final=True)
+            if data:
+                yield data
+
+    if DB_ASYNC_MODE:
+        rows_loaded = await DatabaseExecutor().run(
+            copy_to_table, table_name, transformer.columns, body()
+        )
+    else:
+        queue = asyncio.Queue(maxsize=COPY_QUEUE_SIZE)
+        producer = asyncio.ensure_future(fill_queue(queue, body()))
+        try:
+            rows_loaded = await DatabaseExecutor().run(
+                copy_expert,
+                table_name,
+                transformer.columns,
+                QueueReader(queue, asyncio.get_running_loop()),
+            )
+        finally:
+            producer.cancel()
+
+    return {
+        "rows_loaded": rows_loaded,
+        "rows_rejected": transformer.rows_rejected,
+        "rejected_rows": transformer.rejected_rows,
+    }
+
+
+async def fill_queue(queue: asyncio.Queue, source):
+    try:
+        async for data in source:
+            await queue.put(data)
+        await queue.put(b"")
+    except Exception as ex:
+        await queue.put(ex)
+
+
+def get_copy_engine():
+    engine = DbConfig().get_engine()
+    if engine.dialect.name != "postgresql":
+        raise Exception(
+            "COPY is only supported for PostgreSQL databases", {"status_code": 501}
+        )
+    return engine
+
+
+def copy_expert(table_name: str, columns: list, source: QueueReader) -> int:
+    """Run `COPY ... FROM STDIN` through psycopg2, reading the rows from `source`"""
+    engine = get_copy_engine()
+    preparer = engine.dialect.identifier_preparer
+    statement = (
+        f"COPY {preparer.quote(table_name)} "
+        f"({', '.join(preparer.quote(column) for column in columns)}) "
+        "FROM STDIN WITH (FORMAT csv)"
+    )
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.copy_expert(statement, source)
+        rows_loaded = cursor.rowcount
+        connection.commit()
+        return rows_loaded
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def copy_to_table(table_name: str, columns: list, source) -> int:
+    """
+    Run `COPY ... FROM STDIN` through asyncpg, reading the rows from the async iterable
+    `source`. Must run inside a SQLAlchemy greenlet (see `DatabaseExecutor`).
+    """
+    connection = get_copy_engine().raw_connection()
+    try:
+        status = await_only(
+            connection.driver_connection.copy_to_table(
+                table_name, source=source, columns=columns, format="csv"
+            )
+        )
+        connection.commit()
+        return int(status.split()[-1])
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
@@ -3,12 +3,35 @@
     ~~~~~~~~~~~~~~~~~~~~~~~~~
 """
 
+import base64
+import copy
+import json
 import logging
-
-from sqlalchemy import and_, asc, desc, or_
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, time
+
+from sqlalchemy import (
+    Integer,
+    and_,
+    asc,
+    bindparam,
+    delete,
+    desc,
+    func,
+    or_,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import RelationshipProperty
+from sqlalchemy.sql.expression import ClauseElement, Executable
 from sqlalchemy.sql.schema import Table
 
+from config.settings import STATEMENT_CACHE_SIZE
+
 """ Valid operators """
 OPERATORS = {
     "like": lambda f, a: f.like(a),
@@ -24,44 +47,358 @@ OPERATORS = {
 }
 
 
+""" Placeholder of a bound value in the shape of a query (see `DynamicFilter.shape`) """
+Parameter = namedtuple("Parameter", ["index", "expanding"])
+
+
 class OperatorNotFound(Exception):
     pass
 
 
+class Explain(Executable, ClauseElement):
+    """`EXPLAIN (FORMAT JSON)` of a statement, returning the plan without running it"""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def compile_explain(element, compiler, **kwargs):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kwargs)
+
+
+def coerce_value(attr, value):
+    """
+    Convert query string values to the python type of the column.
+
+    psycopg2 lets postgres cast string parameters, but asyncpg requires parameters
+    of the exact column type.
+    """
+    if isinstance(value, list):
+        return [coerce_value(attr, item) for item in value]
+    if not isinstance(value, str):
+        return value
+    try:
+        python_type = attr.type.python_type
+    except (AttributeError, NotImplementedError):
+        return value
+    try:
+        if python_type is str:
+            return value
+        elif python_type is bool:
+            return value.lower() in ["true", "t", "1", "yes"]
+        elif python_type in [date, datetime, time]:
+            return python_type.fromisoformat(value)
+        elif python_type in [int, float] or python_type.__name__ == "Decimal":
+            return python_type(value)
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
 class DynamicFilter:
+    """
+    Builds the query of the filter, sort and pagination parameters of a request.
+
+    The statements executed on the connection (see `cached_statement`) are built from the
+    shape of the parsed parameters, where every filter, cursor and page value is replaced
+    by a bound parameter, and cached by (model, statement kind, shape). A request of a known
+    shape only binds its values: the cached statement object also hits the compiled cache
+    of the engine, so neither the query nor its SQL is built again.
+    """
+
+    statement_cache = OrderedDict()
+    statement_cache_hits = 0
+    statement_cache_misses = 0
+    __lock = threading.Lock()
+
     def __init__(self, model, session, query, enabled_fields=None, page_size=10):
         """Initializator of the class 'DynamicFilter'"""
         self.model = model
         self.query = self.query_to_kwargs(query)
-        self.model_query = session.query(model)
+        self.base_query = self.model_query = session.query(model)
         self.enabled_fields = enabled_fields
         self.page_size = page_size
+        self.where_query = None
+        self.binds = {}
+        self._shape = None
+
+    def search(self, count=True):
+        """Return the filtered query, its number of rows (None unless `count`) and the page"""
+        result = self.filtered_query()
+        count = self.count() if count else None
+        page = self.paginated_query(result)
+        return result, count, page
 
-    def search(self):
+    def filtered_query(self, ordered=True):
+        """Return the filtered (and unless `ordered` is False, sorted) query, without pagination"""
         filters = self.query
-        result = self.model_query
         keys = filters.keys()
-        count = 0
-
-        if "or_and" in keys:
-            result = self.or_and_perser(filters["or_and"])
-            filters.pop("or_and")
-            logging.info(filters)
-        if "filter" in keys:
-            result = self.parse_filter(filters["filter"])
-        if "sort" in keys:
+
+        if self.where_query is None:
+            result = self.model_query
+            if "or_and" in keys:
+                result = self.or_and_perser(filters["or_and"])
+                logging.info(filters)
+            if "filter" in keys:
+                result = self.parse_filter(filters["filter"])
+            self.where_query = result
+
+        result = self.where_query
+        if not ordered:
+            return result
+        if "cursor" in keys or "limit" in keys:
+            result = self.seek(result, filters.get("cursor", None))
+        elif "sort" in keys:
             result = result.order_by(*self.sort(filters["sort"]))
-        count = result.count()
-        page = self.page(
-            result, filters.get("offset", None), filters.get("limit", None)
-        )
-        return result, count, page
+        return result
+
+    def projection(self):
+        """
+        Return the table columns requested by the `fields` parameter (all columns without
+        it), validated against the reflected columns. The keyset fields of a page are always
+        selected, to encode the cursor of the next page.
+        """
+        columns = self.model.__table__.columns
+        if "fields" not in self.query:
+            return list(columns)
+        fields = self.query["fields"]
+        invalid = [field for field in fields if field not in columns]
+        if invalid:
+            raise Exception(f"Invalid field(s): {', '.join(invalid)}", {"status_code": 400})
+        if "limit" in self.query or "cursor" in self.query:
+            fields = fields + [field for field, direction in self.keyset()]
+        return [columns[field] for field in dict.fromkeys(fields)]
+
+    def select_statement(self, *extra_columns):
+        """
+        Return the Core SELECT of the projected columns (see `projection`) for the page, to
+        be executed on the connection without hydrating ORM objects.
+        """
+        query = self.filtered_query().with_entities(*self.projection(), *extra_columns)
+        return self.paginated_query(query).statement
+
+    def shape(self):
+        """
+        Return the shape of the parsed parameters and their bound values: every value is
+        replaced by a `Parameter` placeholder, except the ones changing the structure of the
+        query (empty values, `is_null` and null conditions, NULL cursor values).
+        """
+        if self._shape is not None:
+            return self._shape
+
+        values = []
+
+        def parameter(value):
+            values.append(value)
+            return Parameter(len(values) - 1, isinstance(value, list))
+
+        def shape_value(key, value):
+            if isinstance(value, dict):
+                return {item: shape_value(item, item_value) for item, item_value in value.items()}
+            if key == "is_null" or value is None or value in ["", "null", "not_null"]:
+                return value
+            return parameter(value)
+
+        shape = {}
+        for key, value in self.query.items():
+            if key in ["filter", "or_and", "limit", "offset"]:
+                shape[key] = shape_value(key, value)
+            elif key == "cursor":
+                shape[key] = [
+                    None if item is None else parameter(item)
+                    for item in self.cursor_values(value)
+                ]
+            else:
+                shape[key] = value
+        self._shape = shape, values
+        return self._shape
+
+    def cached_statement(self, kind: str = "page"):
+        """
+        Return the Core statement of the request and its bound parameters. `kind` is "page"
+        (see `select_statement`), "total" for the page with the `_total` window column (see
+        `total_column`), "count" for the number of matching rows, or "update" / "delete" for
+        an `UPDATE` (without its values) / `DELETE` of the matching rows returning their ids.
+        """
+        shape, values = self.shape()
+        key = (self.model, kind, self.freeze(shape))
+        cls = type(self)
+        with cls.__lock:
+            entry = cls.statement_cache.get(key, None)
+            if entry is not None:
+                cls.statement_cache.move_to_end(key)
+                cls.statement_cache_hits += 1
+            else:
+                cls.statement_cache_misses += 1
+
+        if entry is None:
+            builder = copy.copy(self)
+            builder.query = copy.deepcopy(shape)
+            builder.model_query = self.base_query
+            builder.where_query = None
+            builder.binds = {}
+            if kind == "count":
+                query = builder.filtered_query(ordered=False)
+                statement = select(func.count()).select_from(query.subquery())
+            elif kind in ["update", "delete"]:
+                table = self.model.__table__
+                where = builder.filtered_query(ordered=False).whereclause
+                #   A table is never written as a whole
+                if where is None:
+                    raise Exception(
+                        f"A filter is required for a bulk {kind}", {"status_code": 400}
+                    )
+                statement = update(table) if kind == "update" else delete(table)
+                statement = statement.where(where).returning(table.c.id)
+            elif kind == "total":
+                statement = builder.select_statement(builder.total_column().label("_total"))
+            else:
+                statement = builder.select_statement()
+            entry = statement, {
+                name: (index, attr) for name, (index, attr, bind) in builder.binds.items()
+            }
+            with cls.__lock:
+                cls.statement_cache[key] = entry
+                while len(cls.statement_cache) > STATEMENT_CACHE_SIZE:
+                    cls.statement_cache.popitem(last=False)
+
+        statement, binds = entry
+        parameters = {
+            name: int(values[index]) if attr is None else coerce_value(attr, values[index])
+            for name, (index, attr) in binds.items()
+        }
+        return statement, parameters
+
+    @classmethod
+    def freeze(cls, value):
+        """Return the shape as nested tuples, to be used as a cache key"""
+        if isinstance(value, dict):
+            return tuple((key, cls.freeze(item)) for key, item in value.items())
+        if isinstance(value, list):
+            return tuple(cls.freeze(item) for item in value)
+        return value
+
+    @classmethod
+    def statement_cache_stats(cls) -> dict:
+        """Return the size and hit/miss counters of the statement cache"""
+        with cls.__lock:
+            return {
+                "statements": len(cls.statement_cache),
+                "max_statements": STATEMENT_CACHE_SIZE,
+                "hits": cls.statement_cache_hits,
+                "misses": cls.statement_cache_misses,
+            }
+
+    def bind(self, attr, value):
+        """
+        Return the value compared with `attr`: the bound parameter of a `Parameter`
+        placeholder when building a cached statement, else the value coerced to the column
+        type. `attr` is None for the offset and limit.
+        """
+        if not isinstance(value, Parameter):
+            return value if attr is None else coerce_value(attr, value)
+        name = f"p{value.index}"
+        if name not in self.binds:
+            type_ = Integer() if attr is None else attr.type
+            self.binds[name] = (
+                value.index,
+                attr,
+                bindparam(name, type_=type_, expanding=value.expanding),
+            )
+        return self.binds[name][2]
+
+    @staticmethod
+    def parse_fields(value: list) -> list:
+        """Parse the comma separated (or repeated) `fields` query parameter"""
+        return [
+            field.strip() for item in value or [] for field in item.split(",") if field.strip()
+        ]
+
+    def count(self, estimate=False):
+        """
+        Return the number of rows matching the filters. With `estimate` the planner estimate
+        is returned instead of counting the rows on postgres: `pg_class.reltuples` for an
+        unfiltered table, the row estimate of `EXPLAIN` for a filtered one.
+        """
+        if estimate:
+            #   Parsed on a copy, the filters of the fallback count must stay untouched
+            builder = copy.copy(self)
+            builder.query = copy.deepcopy(self.query)
+            builder.model_query = self.base_query
+            builder.where_query = None
+            builder.binds = {}
+            estimated = self.estimate_count(builder.filtered_query(ordered=False))
+            if estimated is not None:
+                return estimated
+        statement, parameters = self.cached_statement("count")
+        return self.model_query.session.connection().execute(statement, parameters).scalar()
+
+    def estimate_count(self, query):
+        """Return the planner row estimate of the query, None if it is not available"""
+        connection = query.session.connection()
+        if connection.dialect.name != "postgresql":
+            return None
+
+        if query.whereclause is None:
+            table_name = connection.dialect.identifier_preparer.format_table(
+                self.model.__table__
+            )
+            reltuples = connection.execute(
+                text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table_name)"),
+                {"table_name": table_name},
+            ).scalar()
+            # -1 for a table which has never been vacuumed or analyzed
+            if reltuples is None or reltuples < 0:
+                return None
+            return int(reltuples)
+
+        plan = connection.execute(Explain(query.statement)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def total_column(self):
+        """
+        Column counting the rows matching the filters in the same query as the page:
+        `COUNT(*) OVER ()`, or a count subquery for a keyset page, whose seek condition
+        would only count the rows after the cursor.
+        """
+        if self.query.get("cursor", None):
+            where_query = self.filtered_query(ordered=False)
+            return select(func.count()).select_from(where_query.subquery()).scalar_subquery()
+        return func.count().over()
+
+    def page_info(self, rows: list, total: int = None) -> dict:
+        """Return the page number, limit and cursor of the next page of a page of `rows`"""
+        limit = self.query.get("limit", None)
+        limit = int(limit) if limit else None
+        next_cursor = self.next_cursor(rows)
+        page = None
+        if not self.query.get("cursor", None):
+            offset = int(self.query.get("offset", None) or 0)
+            page = offset // limit + 1 if limit else 1
+            if total is not None and offset + len(rows) >= total:
+                next_cursor = None
+        return {"total": total, "page": page, "limit": limit, "next": next_cursor}
+
+    def paginated_query(self, query=None):
+        """
+        Return the page of the query requested by the offset and limit parameters.
+        A keyset page (`cursor` parameter) ignores the offset.
+        """
+        if query is None:
+            query = self.filtered_query()
+        offset = None if "cursor" in self.query else self.query.get("offset", None)
+        return self.page(query, offset, self.query.get("limit", None))
 
     def page(self, query, offset, limit):
         if offset:
-            query = query.offset(offset)
+            query = query.offset(self.bind(None, offset))
         if limit:
-            query = query.limit(limit)
+            query = query.limit(self.bind(None, limit))
         return query
 
     def parse_filter(self, filters):
@@ -100,13 +437,46 @@ class DynamicFilter:
                         yield field, operator, "-1"
                 else:
                     yield field, operator, value
-        elif type(field_value) is str:
+        elif type(field_value) is str or isinstance(field_value, Parameter):
             operator = "equals"
             value = field_value
         else:
             raise OperatorNotFound()
         yield field, operator, value
 
+    def validate_filters(self):
+        """
+        Raise a 400 error for the filters on unknown columns or with unknown operators,
+        which the query parsing otherwise leaves out.
+        """
+        fields = {}
+        for filter_type in ["and", "or"]:
+            fields.update(self.query.get("filter", {}).get(filter_type, {}))
+        for conditions in self.query.get("or_and", {}).values():
+            fields.update(dict.fromkeys(conditions))
+
+        columns = self.model.__table__.columns
+        #   A dotted field filters on a relationship of the model
+        invalid = [
+            field
+            for field in fields
+            if field not in columns
+            and not ("." in field and hasattr(self.model, field.split(".")[0]))
+        ]
+        if invalid:
+            raise Exception(f"Invalid filter field(s): {', '.join(invalid)}", {"status_code": 400})
+        operators = [
+            operator
+            for value in fields.values()
+            if isinstance(value, dict)
+            for operator in value
+            if not self.verify_operator(operator)
+        ]
+        if operators:
+            raise Exception(
+                f"Invalid filter operator(s): {', '.join(operators)}", {"status_code": 400}
+            )
+
     @staticmethod
     def verify_operator(operator):
         """Verify if the operator is valid"""
@@ -140,9 +510,14 @@ class DynamicFilter:
                 else:
                     break
 
-            return OPERATORS[operator](attr, value)
+            return self.apply_operator(operator, attr, value)
 
-        return OPERATORS[operator](getattr(model, field, None), value)
+        return self.apply_operator(operator, getattr(model, field, None), value)
+
+    def apply_operator(self, operator, attr, value):
+        if operator != "is_null":
+            value = self.bind(attr, value)
+        return OPERATORS[operator](attr, value)
 
     def make_or_query(self, filter_dict: dict):
         for key, value in filter_dict["or_conditions"].items():
@@ -169,7 +544,7 @@ class DynamicFilter:
         # Build the OR conditions
         or_conditions = or_(
             *[
-                getattr(self.model, key, None).in_(value)
+                getattr(self.model, key, None).in_(self.bind(getattr(self.model, key), value))
                 if value not in ["null", "not_null"] and hasattr(self.model, key)
                 else self.null_parser(key, value)
                 for key, value in filter_dict["or_conditions"].items()
@@ -181,7 +556,7 @@ class DynamicFilter:
             True
             if and_conditions
             else and_(
-                getattr(self.model, key, None) == value
+                getattr(self.model, key, None) == self.bind(getattr(self.model, key), value)
                 for key, value in filter_dict["and_conditions"].items()
                 if hasattr(self.model, key)
             )
@@ -215,9 +590,102 @@ class DynamicFilter:
                 order.append(desc(getattr(self.model, field, None)))
         return order
 
+    def keyset(self):
+        """Return the (field, direction) pairs ordering a keyset page, `id` breaks ties"""
+        sort = dict(self.query.get("sort", {}))
+        direction = next(iter(sort.values()), "asc")
+        sort.pop("id", None)
+        keyset = list(sort.items()) + [("id", direction)]
+        for field, field_direction in keyset:
+            if getattr(self.model, field, None) is None:
+                raise Exception(f"Invalid sort field: {field}", {"status_code": 400})
+            if field_direction != direction:
+                raise Exception(
+                    "Cursor pagination requires a single sort direction",
+                    {"status_code": 400},
+                )
+        return keyset
+
+    def seek(self, query, cursor):
+        """
+        Order the query by the keyset and seek past the row encoded in the cursor with a
+        `WHERE (sort_key, id) > (...)` condition, so the page is read from the index
+        instead of skipping `OFFSET` rows. Without a cursor (first page, or a page of
+        `limit`/`offset` pagination) the query is only ordered, with `id` breaking ties.
+        The cursor is either encoded or the list of its values (see `shape`).
+        """
+        keyset = self.keyset()
+        query = query.order_by(*self.sort(dict(keyset)))
+        if not cursor:
+            return query
+
+        if isinstance(cursor, str):
+            cursor = self.cursor_values(cursor)
+        columns = [getattr(self.model, field) for field, direction in keyset]
+        values = [
+            None if value is None else self.bind(column, value)
+            for column, value in zip(columns, cursor)
+        ]
+        return query.filter(self.seek_condition(columns, values, keyset[-1][1]))
+
+    def cursor_values(self, cursor: str) -> list:
+        """Return the values of the cursor, validated against the keyset of the request"""
+        state = self.decode_cursor(cursor)
+        if state.get("sort") != [list(key) for key in self.keyset()]:
+            raise Exception("The cursor does not match the sort order", {"status_code": 400})
+        return state["values"]
+
+    @staticmethod
+    def seek_condition(columns: list, values: list, direction: str):
+        """
+        Condition selecting the rows after `values` in the keyset order. Postgres sorts
+        NULL sort keys last in ascending and first in descending order.
+        """
+        after = (lambda a, b: a > b) if direction == "asc" else (lambda a, b: a < b)
+        if len(columns) == 1:
+            return after(columns[0], values[0])
+
+        column, id_column = columns
+        value, id_value = values
+        if value is None:
+            condition = and_(column.is_(None), after(id_column, id_value))
+            return condition if direction == "asc" else or_(condition, column.isnot(None))
+        condition = after(tuple_(column, id_column), tuple_(value, id_value))
+        if direction == "asc" and column.nullable:
+            return or_(condition, column.is_(None))
+        return condition
+
+    def next_cursor(self, rows: list):
+        """Return the cursor of the page following `rows`, None on the last page"""
+        limit = self.query.get("limit", None)
+        if not rows or not limit or len(rows) < int(limit):
+            return None
+        keyset = self.keyset()
+        values = [rows[-1].get(field) for field, direction in keyset]
+        return self.encode_cursor(keyset, values)
+
+    @staticmethod
+    def encode_cursor(keyset: list, values: list) -> str:
+        state = json.dumps({"sort": keyset, "values": values}, default=str)
+        return base64.urlsafe_b64encode(state.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> dict:
+        try:
+            state = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            state = json.loads(state)
+            if not isinstance(state, dict) or not isinstance(state.get("values"), list):
+                raise ValueError(cursor)
+            return state
+        except ValueError:
+            raise Exception("Invalid cursor", {"status_code": 400})
+
     def update_dict(self, d: dict, keys: list, values: list):
         if len(keys) == 1:
-            d[keys[0]] = values[0]
+            value = values[0]
+            if keys[0] in ["in", "not_in"] and isinstance(value, str):
+                value = value.split(",")
+            d[keys[0]] = value
         else:
             key = keys[0]
             if key not in d:
@@ -253,6 +721,10 @@ class DynamicFilter:
                     kwargs[key] = value[0]
                 elif key == "offset":
                     kwargs[key] = value[0]
+                elif key == "cursor":
+                    kwargs[key] = value[0]
+                elif key == "fields":
+                    kwargs[key] = self.parse_fields(value)
                 elif key == "sort":
                     if value[0].endswith("__desc") or value[0].endswith("__asc"):
                         sort_key, sort_order = value[0].rsplit("__", 1)
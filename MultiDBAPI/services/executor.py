@@ -0,0 +1,109 @@
+"""
+    DatabaseExecutor
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.util import greenlet_spawn
+
+from config.settings import DB_ASYNC_MODE, DB_EXECUTOR_WORKERS
+
+
+class DatabaseExecutor:
+    """
+    Runs the synchronous database code (Model methods, DynamicFilter, DbConfig reflection)
+    on behalf of the async request handlers.
+
+    With an async driver (`DB_ENGINE=postgresql+asyncpg`) the call is executed inside a
+    SQLAlchemy greenlet, so every database round trip of the sync code is awaited on the
+    event loop through the `AsyncEngine` instead of blocking it.
+
+    With a sync driver the call is offloaded to a bounded thread pool of
+    `DB_EXECUTOR_WORKERS` threads, so the event loop keeps accepting and parsing requests
+    while queries are in flight. The context of the request (see `DbConfig`) is copied
+    into the worker thread.
+    """
+
+    __instance = None
+
+    def __new__(cls):
+        """
+        Singleton: Return Single Unique Instance
+        """
+
+        if cls.__instance is None:
+            cls.__instance = super().__new__(cls)
+            cls.__instance._executor = None
+            cls.__instance._lock = threading.Lock()
+            cls.__instance._queued = 0
+            cls.__instance._running = 0
+            cls.__instance._completed = 0
+            cls.__instance._total_wait = 0.0
+            cls.__instance._max_wait = 0.0
+            cls.__instance._total_run = 0.0
+        return cls.__instance
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="multidb-db"
+            )
+        return self._executor
+
+    async def run(self, function, *args, **kwargs):
+        """Run `function` with the given arguments and return its result"""
+        if DB_ASYNC_MODE:
+            return await greenlet_spawn(function, *args, **kwargs)
+
+        with self._lock:
+            self._queued += 1
+        call = functools.partial(
+            contextvars.copy_context().run, function, *args, **kwargs
+        )
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._measure, call, time.monotonic()
+        )
+
+    def _measure(self, call, submitted_at: float):
+        started_at = time.monotonic()
+        wait = started_at - submitted_at
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        try:
+            return call()
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._total_run += time.monotonic() - started_at
+
+    def shutdown(self):
+        """Wait for the running calls and stop the worker threads"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        """Return queue depth and wait time metrics of the executor"""
+        with self._lock:
+            completed = self._completed or 1
+            return {
+                "mode": "asyncio" if DB_ASYNC_MODE else "thread_pool",
+                "workers": DB_EXECUTOR_WORKERS,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "avg_wait_ms": round(self._total_wait / completed * 1000, 3),
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+                "avg_run_ms": round(self._total_run / completed * 1000, 3),
+            }
@@ -0,0 +1,126 @@
+"""
+    ReflectionCache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import itertools
+import logging
+import threading
+import time
+
+from config.db import DbConfig
+from config.settings import REFLECTION_CACHE_TTL, REFLECTION_VERSION_CHECK_INTERVAL
+
+
+class ReflectionCache:
+    """
+    Process-wide cache of reflected table columns keyed by (engine key, table), the engine
+    key being the host, database and credential hash of `DbConfig.engine_key`: an entry
+    is only served to the credentials that reflected it, never to another user of the
+    same database.
+
+    Entries are shared by the model factory, the schema factory and `/schema`. An entry is
+    reflected again when it is older than `REFLECTION_CACHE_TTL`, or when the catalog
+    marker of the table (see `DbConfig.get_table_version`), polled at most every
+    `REFLECTION_VERSION_CHECK_INTERVAL` seconds, has changed. Every reflection gets a new
+    `generation`, which the factories use to rebuild their derived classes.
+    """
+
+    __instance = None
+
+    def __new__(cls):
+        """
+        Singleton: Return Single Unique Instance
+        """
+
+        if cls.__instance is None:
+            cls.__instance = super().__new__(cls)
+            cls.__instance._entries = {}
+            cls.__instance._generations = itertools.count(1)
+            cls.__instance._lock = threading.Lock()
+        return cls.__instance
+
+    def get(self, table_name: str) -> dict:
+        """
+        Return the cache entry of the table in the current database, for the current
+        credentials: {"database", "engine_key", "table", "columns", "version", "generation", ...}
+        """
+        db_config = DbConfig()
+        key = (db_config.engine_key, table_name)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None and now - entry["loaded_at"] < REFLECTION_CACHE_TTL:
+            if now - entry["checked_at"] < REFLECTION_VERSION_CHECK_INTERVAL:
+                return entry
+            version = db_config.get_table_version(table_name)
+            if version == entry["version"]:
+                entry["checked_at"] = now
+                return entry
+            logging.info(f"Definition of table: {table_name} changed, reflecting again")
+
+        return self.load(table_name)
+
+    def get_columns(self, table_name: str) -> list:
+        return self.get(table_name)["columns"]
+
+    def load(self, table_name: str) -> dict:
+        """Reflect the table of the current database and store it in the cache"""
+        db_config = DbConfig()
+        try:
+            version = db_config.get_table_version(table_name)
+            columns = db_config.get_db_columns(table_name)
+        except Exception:
+            self.invalidate(db_config.database_name, table_name)
+            raise
+        return self.put(db_config.engine_key, table_name, columns, version)
+
+    def load_many(self, table_names: list = None) -> list:
+        """
+        Reflect the tables of the current database in bulk (all tables if `table_names`
+        is None) and store them in the cache. Returns the new entries.
+        """
+        db_config = DbConfig()
+        tables_info = db_config.get_db_tables_info(table_names)
+        versions = db_config.get_table_versions(list(tables_info))
+        return [
+            self.put(
+                db_config.engine_key,
+                table_name,
+                table_info.pop("columns"),
+                versions.get(table_name),
+                **table_info,
+            )
+            for table_name, table_info in tables_info.items()
+        ]
+
+    def put(
+        self, engine_key: tuple, table_name: str, columns: list, version=None, **table_info
+    ) -> dict:
+        """
+        Store the columns of a table reflected with the credentials of `engine_key` (see
+        `DbConfig.engine_key`). `table_info` holds the optional primary key, indexes and
+        foreign keys of a bulk reflection.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = {
+                "database": engine_key[2],
+                "engine_key": engine_key,
+                "table": table_name,
+                "columns": columns,
+                "version": version,
+                "generation": next(self._generations),
+                "loaded_at": now,
+                "checked_at": now,
+                **table_info,
+            }
+            self._entries[(engine_key, table_name)] = entry
+        return entry
+
+    def invalidate(self, database_name: str, table_name: str = None):
+        """Drop the entries of a table, or of every table of the database, for all credentials"""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry["database"] == database_name and table_name in [None, key[1]]:
+                    self._entries.pop(key, None)
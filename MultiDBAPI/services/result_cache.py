@@ -0,0 +1,349 @@
+"""
+    ResultCache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import namedtuple
+
+import orjson
+from blacksheep import Content, Request, Response
+from cachetools import TLRUCache
+
+from config.db import DbConfig
+from config.settings import (
+    REDIS_HOST,
+    REDIS_PORT,
+    RESULT_CACHE_LOCAL_SIZE,
+    RESULT_CACHE_STATUS,
+    RESULT_CACHE_TABLE_TTLS,
+    RESULT_CACHE_TIERS,
+    RESULT_CACHE_TTL,
+)
+
+try:
+    from redis import asyncio as redis
+    from redis.exceptions import RedisError
+except ImportError:
+    redis = None
+    RedisError = OSError
+
+KEY_PREFIX = "multidb"
+INVALIDATION_CHANNEL = f"{KEY_PREFIX}:invalidate"
+# Seconds Redis is bypassed after a failure
+REDIS_RETRY_DELAY = 5
+
+""" Cached response, `expires_at` on the `time.monotonic` clock """
+CachedResponse = namedtuple(
+    "CachedResponse", ["headers", "content_type", "body", "expires_at"]
+)
+
+
+def response_size(entry: CachedResponse) -> int:
+    """Size in bytes of a cached response, as accounted by the local tier"""
+    return (
+        len(entry.body)
+        + len(entry.content_type)
+        + sum(len(name) + len(value) for name, value in entry.headers)
+    )
+
+
+class ResultCache:
+    """
+    Opt-in read-through cache of the `/get`, `/get_count_rows` and `/schema` responses,
+    enabled by `RESULT_CACHE_STATUS=active`, with two tiers (`RESULT_CACHE_TIERS`):
+
+    - local: a per worker LRU of at most `RESULT_CACHE_LOCAL_SIZE` bytes of responses,
+      answering repeated requests without any network round trip.
+    - redis: shared by the workers, read on a miss of the local tier.
+
+    A response is kept for the TTL of its table (`RESULT_CACHE_TABLE_TTLS`, else
+    `RESULT_CACHE_TTL`) under a key made of the database, the table, the generation of the
+    table and a digest of the credentials, path, query parameters and media type of the
+    request. A write to the table increments its generation, in Redis where it is also
+    published on the `multidb:invalidate` channel, so every worker stops reading the
+    previous entries, which then expire with their TTL. Without the redis tier the
+    generation is only incremented in the worker serving the write, the other workers
+    serve their entries until they expire. A Redis failure bypasses the redis tier for
+    `REDIS_RETRY_DELAY` seconds, it never fails the request.
+    """
+
+    __instance = None
+
+    def __new__(cls):
+        """
+        Singleton: Return Single Unique Instance
+        """
+
+        if cls.__instance is None:
+            cls.__instance = super().__new__(cls)
+            cls.__instance._client = None
+            cls.__instance._listener = None
+            cls.__instance._generations = {}
+            cls.__instance._local = TLRUCache(
+                maxsize=RESULT_CACHE_LOCAL_SIZE,
+                ttu=lambda key, entry, now: entry.expires_at,
+                getsizeof=response_size,
+            )
+            cls.__instance._redis_retry_at = 0.0
+            cls.__instance._local_hits = 0
+            cls.__instance._redis_hits = 0
+            cls.__instance._misses = 0
+            cls.__instance._errors = 0
+        return cls.__instance
+
+    @property
+    def enabled(self) -> bool:
+        return RESULT_CACHE_STATUS == "active" and (self.local_enabled or self.redis_enabled)
+
+    @property
+    def local_enabled(self) -> bool:
+        return "local" in RESULT_CACHE_TIERS and RESULT_CACHE_LOCAL_SIZE > 0
+
+    @property
+    def redis_enabled(self) -> bool:
+        return "redis" in RESULT_CACHE_TIERS and redis is not None
+
+    @property
+    def redis_available(self) -> bool:
+        return self.redis_enabled and time.monotonic() >= self._redis_retry_at
+
+    @property
+    def client(self):
+        if self._client is None:
+            #   An unreachable Redis must not hold the requests
+            self._client = redis.Redis(
+                host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=1, socket_timeout=1
+            )
+        return self._client
+
+    def redis_failed(self, function, ex: Exception):
+        self._errors += 1
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_DELAY
+        logging.error(f"Exception from {function.__name__} :  {ex}")
+
+    @staticmethod
+    def table_key(table_name: str) -> str:
+        return "_".join(table_name.split("-")).lower()
+
+    @classmethod
+    def ttl(cls, table_name: str) -> int:
+        """Return the TTL of the responses of the table, 0 if they are not cached"""
+        return int(RESULT_CACHE_TABLE_TTLS.get(cls.table_key(table_name), RESULT_CACHE_TTL))
+
+    @staticmethod
+    def generation_key(database_name: str, table_name: str) -> str:
+        return f"{KEY_PREFIX}:generation:{database_name}:{table_name}"
+
+    async def start(self):
+        """Start listening to the generations published by the other workers"""
+        if self.enabled and self.redis_enabled and self._listener is None:
+            self._listener = asyncio.ensure_future(self.listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def listen(self):
+        #   The subscription waits for messages without a socket timeout
+        client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=1)
+        try:
+            while True:
+                try:
+                    async with client.pubsub() as pubsub:
+                        await pubsub.subscribe(INVALIDATION_CHANNEL)
+                        async for message in pubsub.listen():
+                            if message["type"] == "message":
+                                self.set_generation(**orjson.loads(message["data"]))
+                except (RedisError, OSError) as ex:
+                    logging.error(f"Exception from {self.listen.__name__} :  {ex}")
+                    #   Generations published while disconnected are read again from Redis
+                    self._generations.clear()
+                    await asyncio.sleep(1)
+        finally:
+            await client.aclose()
+
+    def set_generation(self, database_name: str, table_name: str, generation: int):
+        key = (database_name, table_name)
+        self._generations[key] = max(self._generations.get(key, 0), generation)
+
+    async def generation(self, database_name: str, table_name: str) -> int:
+        """Return the generation of the table, read from Redis on first use"""
+        key = (database_name, table_name)
+        if key not in self._generations and self.redis_available:
+            try:
+                generation = await self.client.get(self.generation_key(*key))
+            except (RedisError, OSError) as ex:
+                #   Not kept, the generation is read again once Redis is back
+                self.redis_failed(self.generation, ex)
+                return 0
+            self.set_generation(database_name, table_name, int(generation or 0))
+        return self._generations.get(key, 0)
+
+    async def key(self, request: Request, table_name: str, media_type: str = None):
+        """
+        Return the cache key of the request on the table of the current database, None if
+        the cache is disabled or the table TTL is 0.
+        """
+        if not self.enabled or self.ttl(table_name) <= 0:
+            return None
+        config = DbConfig()
+        table_name = self.table_key(table_name)
+        generation = await self.generation(config.database_name, table_name)
+        #   The query parameters are sorted, their order does not change the result
+        digest = hashlib.sha256(
+            orjson.dumps(
+                [
+                    config.engine_key,
+                    request.path,
+                    sorted(request.query.items()),
+                    media_type,
+                ]
+            )
+        ).hexdigest()
+        return f"{KEY_PREFIX}:result:{config.database_name}:{table_name}:{generation}:{digest}"
+
+    async def get(self, key: str):
+        """Return the cached response of the key, None on a miss"""
+        if key is None:
+            return None
+        entry = self._local.get(key) if self.local_enabled else None
+        if entry is not None:
+            self._local_hits += 1
+            return self.make_response(entry)
+
+        if self.redis_available:
+            try:
+                async with self.client.pipeline(transaction=False) as pipeline:
+                    pipeline.hgetall(key)
+                    pipeline.pttl(key)
+                    values, ttl = await pipeline.execute()
+            except (RedisError, OSError) as ex:
+                self.redis_failed(self.get, ex)
+                values = None
+            if values:
+                self._redis_hits += 1
+                entry = CachedResponse(
+                    [
+                        (name.encode("utf-8"), value.encode("utf-8"))
+                        for name, value in orjson.loads(values[b"headers"])
+                    ],
+                    values[b"content_type"],
+                    values[b"body"],
+                    time.monotonic() + max(ttl, 0) / 1000,
+                )
+                self.store_local(key, entry)
+                return self.make_response(entry)
+
+        self._misses += 1
+        return None
+
+    @staticmethod
+    def make_response(entry: CachedResponse) -> Response:
+        headers = list(entry.headers) + [(b"X-Cache", b"HIT")]
+        return Response(200, headers, Content(entry.content_type, entry.body))
+
+    def store_local(self, key: str, entry: CachedResponse):
+        if not self.local_enabled:
+            return
+        try:
+            self._local[key] = entry
+        except ValueError:
+            #   Larger than the whole local tier
+            pass
+
+    async def set(self, key: str, table_name: str, response: Response) -> Response:
+        """Store a successful response under the key, and return it"""
+        if key is None or response.status != 200 or response.content is None:
+            return response
+        ttl = self.ttl(table_name)
+        entry = CachedResponse(
+            list(response.headers.items()),
+            response.content.type,
+            response.content.body,
+            time.monotonic() + ttl,
+        )
+        self.store_local(key, entry)
+
+        if self.redis_available:
+            headers = [
+                (name.decode("utf-8"), value.decode("utf-8")) for name, value in entry.headers
+            ]
+            try:
+                async with self.client.pipeline(transaction=True) as pipeline:
+                    pipeline.hset(
+                        key,
+                        mapping={
+                            "body": entry.body,
+                            "content_type": entry.content_type,
+                            "headers": orjson.dumps(headers),
+                        },
+                    )
+                    pipeline.expire(key, ttl)
+                    await pipeline.execute()
+            except (RedisError, OSError) as ex:
+                self.redis_failed(self.set, ex)
+        response.add_header(b"X-Cache", b"MISS")
+        return response
+
+    async def invalidate(self, table_name: str):
+        """Increment the generation of the table of the current database and publish it"""
+        if not self.enabled:
+            return
+        database_name = DbConfig().database_name
+        table_name = self.table_key(table_name)
+        if self.redis_available:
+            try:
+                generation = await self.client.incr(
+                    self.generation_key(database_name, table_name)
+                )
+                self.set_generation(database_name, table_name, generation)
+                await self.client.publish(
+                    INVALIDATION_CHANNEL,
+                    orjson.dumps(
+                        {
+                            "database_name": database_name,
+                            "table_name": table_name,
+                            "generation": generation,
+                        }
+                    ),
+                )
+                return
+            except (RedisError, OSError) as ex:
+                self.redis_failed(self.invalidate, ex)
+        #   Without Redis, only the entries of this worker are invalidated
+        generation = self._generations.get((database_name, table_name), 0) + 1
+        self.set_generation(database_name, table_name, generation)
+
+    def stats(self) -> dict:
+        """Return the size, hit, miss and error counters of the cache"""
+        hits = self._local_hits + self._redis_hits
+        lookups = hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "tiers": [
+                tier
+                for tier, enabled in [("local", self.local_enabled), ("redis", self.redis_enabled)]
+                if enabled
+            ],
+            "local_hits": self._local_hits,
+            "redis_hits": self._redis_hits,
+            "misses": self._misses,
+            "errors": self._errors,
+            "hit_ratio": round(hits / lookups, 3) if lookups else None,
+            "local_entries": len(self._local),
+            "local_bytes": self._local.currsize,
+            "local_max_bytes": RESULT_CACHE_LOCAL_SIZE,
+            "tables": len(self._generations),
+        }
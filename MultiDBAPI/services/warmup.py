@@ -0,0 +1,72 @@
+"""
+    Warm Up
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import logging
+import time
+
+from config.db import DbConfig
+from config.request_context import RequestContext
+from models import CustomDerivedModelFactory
+from schemas import CustomDerivedSchemaFactory
+from services.reflection_cache import ReflectionCache
+
+
+def warm_up_database(table_names: list = None) -> dict:
+    """
+    Reflect the tables of the current database in bulk and pre-build their derived
+    models, schemas and `/schema` responses, so the first request per table does not pay
+    for reflection.
+
+    Parameters:
+        table_names (optional): Tables to warm up, every table of the database if None.
+
+    Returns:
+        Dictionary: Summary with the warmed up and failed tables.
+    """
+    started_at = time.monotonic()
+    entries = ReflectionCache().load_many(table_names)
+
+    tables = []
+    failed_tables = []
+    for entry in entries:
+        table_name = entry["table"]
+        try:
+            CustomDerivedModelFactory.get_custom_derived_model(table_name.capitalize())
+            CustomDerivedSchemaFactory.get_custom_derived_model(table_name.capitalize())
+            CustomDerivedSchemaFactory.get_schema(table_name)
+            tables.append(table_name)
+        except Exception as ex:
+            logging.error(f"Exception from {warm_up_database.__name__} ({table_name}): {ex}")
+            failed_tables.append({"table_name": table_name, "Error": str(ex)})
+
+    missing_tables = sorted(set(table_names or []) - {entry["table"] for entry in entries})
+    failed_tables.extend(
+        {"table_name": table_name, "Error": "Table not found"} for table_name in missing_tables
+    )
+
+    summary = {
+        "database_name": DbConfig().database_name,
+        "tables": tables,
+        "failed_tables": failed_tables,
+        "elapsed_ms": round((time.monotonic() - started_at) * 1000, 3),
+    }
+    logging.info(
+        f"Warmed up {len(tables)} tables of database: {summary['database_name']} "
+        f"in {summary['elapsed_ms']} ms"
+    )
+    return summary
+
+
+def warm_up_configured_database(database: dict) -> dict:
+    """
+    Warm up a database of the `WARMUP_DATABASES` setting:
+    {"database_name", "username", "password", "tables" (optional)}
+    """
+    RequestContext(
+        database_name=database.get("database_name"),
+        username=database.get("username"),
+        password=database.get("password"),
+    ).activate()
+    return warm_up_database(database.get("tables"))
@@ -3,12 +3,18 @@ import json
 import logging
 import os
 
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
 
 class DatabaseOperation:
     """
     This class is responsible for communicating with the MultiDBAPI to get data from the different database and different
     table. We have to pass database info when initiate the class. Then we need to send a request to the MultiDBAPI to
     get the data with sending url and endpoints.
+
+    `accept` requests a binary response format from `/get`: `application/msgpack` responses are decoded to Python
+    objects and `application/vnd.apache.arrow.stream` responses to a `pyarrow.Table`.
     """
 
     def __init__(
@@ -19,12 +25,15 @@ class DatabaseOperation:
         password: str = None,
         host: str = None,
         port: str = None,
+        accept: str = None,
     ):
         self._database_name = database_name
         self._table_name = table_name
         self._username = username
         self._password = password
         self.headers = {"Content-Type": "application/json"}
+        if accept is not None:
+            self.headers.update({"Accept": accept})
         self._host = host
         self._port = port
         self._url = f"{self._host}:{self._port}/"
@@ -52,14 +61,26 @@ class DatabaseOperation:
             method, url + endpoint, headers=self.headers, data=payload
         )
         logging.info(f"response code: {response.status_code}")
-        response_text = None
-        try:
-            response_text = response.json()
-        except ValueError:
-            response_text = response.text
+        response_text = self._decode_response(response)
 
         return response.status_code, response_text
 
+    @staticmethod
+    def _decode_response(response):
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type == MSGPACK:
+            import msgpack
+
+            return msgpack.unpackb(response.content)
+        if content_type == ARROW:
+            import pyarrow
+
+            return pyarrow.ipc.open_stream(response.content).read_all()
+        try:
+            return response.json()
+        except ValueError:
+            return response.text
+
     def get_request(self, endpoint: str, params=None, data: dict = None):
         return self.make_request("GET", endpoint, data=data)
 